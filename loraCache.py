@@ -0,0 +1,187 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Result cache for LoRaSim
+
+ Results of runs are stored on disk under a key that hashes everything the
+ result depends on: the engine, the run parameters, the model options, the
+ content of the scenario file (not its path; without one, the content of
+ the default scenario, defaultScenario) and the code version, a hash
+ of the simulator sources (codeFiles). Editing any of them gives new keys,
+ the old entries are never hit again and age out.
+
+ An entry is one small JSON file, written to a temporary file first and
+ renamed, so concurrent runs (worker processes, the job server) share the
+ cache safely. A hit touches the file; when the cache grows beyond maxBytes
+ the least recently used entries are removed until it is below 90% of it.
+
+ Only runs with a seed are cached: without one every run is a new sample.
+ loraRun.runSimulation() looks runs up here (see loraRun.resultCache), and
+ so do loraSim_noprint.py and loraSweep.py when run with --seed, under the
+ same keys (runKey()).
+"""
+"""
+ SYNOPSIS:
+   ./loraCache.py [--clear] [--dir=directory]
+ DESCRIPTION:
+    prints the number of entries and the size of the cache, or empties it.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import loraScenario
+
+# bump when the layout or the meaning of an entry changes
+cacheVersion = 1
+
+cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.result-cache')
+
+# the sources a result depends on
+codeFiles = ['loraSim_noprint.py', 'loraScenario.py', 'loraTraffic.py', 'loraTimers.py',
+             'loraSweep.py', 'loraSlotted.py', 'loraLog.py', 'loraRun.py']
+
+codeHash = None
+
+# what runs without a scenario use: the sweep engines read this file
+# (loraSweep.defaultScenario), the simulator has its link losses built in
+defaultScenario = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios', 'ufsm.json')
+
+def codeVersion():
+    global codeHash
+    if codeHash is None:
+        h = hashlib.sha1()
+        for name in codeFiles:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+                h.update(f.read())
+        codeHash = h.hexdigest()
+    return codeHash
+
+# options that do not change the results
+reportOptions = ['--nosave', '--progress', '--status', '--nocache']
+
+# options that write files, runs with them are not cached
+outputOptions = ['--stats']
+
+# options that change the results, in a canonical order
+def modelOptions(options):
+    return sorted(o for o in options if o.split('=', 1)[0] not in reportOptions)
+
+#
+# key of a run: engine name, parameters as in loraRun.runSimulation() and
+# the model options (modelOptions()). Without a scenario the
+# default one is hashed, under a name of its own: a run given the file is
+# not the same run.
+#
+def resultKey(engine, params, options):
+    params = dict(params)
+    if params['scenario'] is not None:
+        params['scenario'] = loraScenario.loadScenario(params['scenario'])
+    else:
+        params['defaultScenario'] = loraScenario.loadScenario(defaultScenario)
+    params['options'] = list(options)
+    text = json.dumps([cacheVersion, codeVersion(), engine, params], sort_keys=True)
+    return hashlib.sha1(text).hexdigest()
+
+# key of a run with the options in params, None if it is not cached
+def runKey(engine, params):
+    options = modelOptions(params['options'])
+    if params['seed'] is None or any(o.split('=', 1)[0] in outputOptions for o in options):
+        return None
+    return resultKey(engine, params, options)
+
+class resultCache():
+    def __init__(self, directory=cacheDir, maxBytes=64 << 20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        # size of the cache as far as this process knows, None until scanned
+        self.size = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    # the stored result, None if there is none
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+            # mark it as used
+            os.utime(self.path(key), None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry['result']
+
+    def put(self, key, result, params=None):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # someone else was faster
+                pass
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': key, 'params': params, 'result': result}, f, sort_keys=True)
+        os.rename(tmp, self.path(key))
+        if self.size is None:
+            self.size = self.usage()[1]
+        else:
+            self.size += os.path.getsize(self.path(key))
+        if self.size > self.maxBytes:
+            self.evict()
+
+    # (modification time, size, path) of all entries
+    def entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def usage(self):
+        entries = self.entries()
+        return len(entries), sum(e[1] for e in entries)
+
+    # remove the least recently used entries down to 90% of maxBytes; other
+    # processes may have added entries, so the directory is scanned again
+    def evict(self):
+        entries = sorted(self.entries())
+        size = sum(e[1] for e in entries)
+        for mtime, nbytes, path in entries:
+            if size <= 0.9*self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= nbytes
+        self.size = size
+
+    def clear(self):
+        for mtime, nbytes, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    cache = resultCache(opts.get('dir', cacheDir))
+    if 'clear' in opts:
+        cache.clear()
+    count, size = cache.usage()
+    print "cache:", cache.directory
+    print "entries:", count
+    print "size (in bytes):", size
+    print "code version:", codeVersion()
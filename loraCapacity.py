@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Capacity search for LoRaSim
+
+ Finds the largest number of nodes (for a fixed avgSendTime) or the smallest
+ avgSendTime (for a fixed number of nodes) that still meets a target DER.
+ DER falls with the load, so the answer is bracketed and then bisected
+ (geometrically for the send time). At every probe replications are added
+ until the confidence interval of the DER lies on one side of the target;
+ a probe that stays undecided after the maximum number of replications is
+ indistinguishable from the target and ends the search.
+
+ Runs already in the run table of loraRun.py made with the same engine (or
+ one giving the same results, see loraRun.engineClass()) count as
+ replications, and new runs are recorded there, so repeated searches get
+ cheaper.
+"""
+"""
+ SYNOPSIS:
+   ./loraCapacity.py nodes <der> <avgsend> <payload> <experiment> [--options]
+   ./loraCapacity.py sendtime <der> <nodes> <payload> <experiment> [--options]
+ DESCRIPTION:
+    options
+        --simtime=3600000   simulated time per run (ms)
+        --collision=0       full collision check
+        --scenario=file     scenario file
+        --maxnodes=N        upper limit for the node count (default: what the
+                            scenario or the built-in link losses provide)
+        --reps=10           maximum replications per probe
+        --z=1.96            width of the confidence interval
+        --rtol=0.02         relative resolution of the send time
+        --engine=simpy      engine of loraRun.py
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+import loraRun
+import loraScenario
+
+class capacitySearch():
+    def __init__(self, payloadSize, experiment, target, simtime=3600000,
+                 full_collision=False, scenario=None, options=(), maxReps=10,
+                 z=1.96, engine='simpy'):
+        self.payloadSize = payloadSize
+        self.experiment = experiment
+        self.target = target
+        self.simtime = simtime
+        self.full_collision = bool(full_collision)
+        self.scenario = scenario and os.path.abspath(scenario)
+        self.options = tuple(loraRun.modelOptions(options))
+        self.maxReps = maxReps
+        self.z = z
+        self.engine = engine
+        self.simulations = 0
+        self.samples = {}
+        for run in loraRun.loadRuns():
+            if (run['payloadSize'], run['experiment'], run['simtime'], run['full_collision'],
+                run['scenario'], tuple(run['options']), loraRun.engineClass(run['engine'])) == \
+               (payloadSize, experiment, simtime, self.full_collision, self.scenario, self.options,
+                loraRun.engineClass(engine)) \
+               and run['sent'] > 0:
+                point = (run['nrNodes'], run['avgSendTime'])
+                self.samples.setdefault(point, []).append(run['received']/float(run['sent']))
+
+    #
+    # +1 if the DER at this point meets the target, -1 if it does not and
+    # 0 if it cannot be told apart from it with maxReps replications. To stay
+    # on the safe side an undecided point below the target fails. A run
+    # that sent nothing has no DER and is skipped, as in the run table; the
+    # probe gives up after maxReps runs, failing if none sent anything.
+    #
+    def probe(self, nrNodes, avgSendTime):
+        der = self.samples.setdefault((nrNodes, avgSendTime), [])
+        runs = 0
+        while True:
+            if len(der) >= 3:
+                mean = np.mean(der)
+                half = self.z*np.std(der, ddof=1)/math.sqrt(len(der))
+                if mean - half > self.target:
+                    return 1
+                if mean + half < self.target:
+                    return -1
+            if len(der) >= self.maxReps or runs >= self.maxReps:
+                if not der:
+                    return -1
+                return 0 if np.mean(der) >= self.target else -1
+            res = loraRun.runSimulation(nrNodes, avgSendTime, self.payloadSize, self.experiment,
+                                        self.simtime, self.full_collision, scenario=self.scenario,
+                                        engine=self.engine, options=self.options)
+            self.simulations += 1
+            runs += 1
+            if res['sent']:
+                der.append(res['received']/float(res['sent']))
+
+    def estimate(self, nrNodes, avgSendTime):
+        der = self.samples.get((nrNodes, avgSendTime), [])
+        return np.mean(der) if der else float('nan')
+
+    #
+    # largest node count meeting the target, None if even one node fails
+    #
+    def maxNodes(self, avgSendTime, limit):
+        # start where the stored runs are, the probes check them anyway
+        known = [n for (n, t) in self.samples if t == avgSendTime and self.samples[(n, t)]]
+        n = min(int(np.median(known)) if known else 16, limit)
+        good, bad = 0, limit + 1
+        while bad - good > 1:
+            verdict = self.probe(n, avgSendTime)
+            if verdict == 0:
+                return n
+            if verdict > 0:
+                good = n
+            else:
+                bad = n
+            if bad > limit:
+                # no failing count yet, double
+                n = min(2*good, limit)
+            else:
+                n = (good + bad)//2
+        return good or None
+
+    #
+    # smallest send time meeting the target, bisected on a log scale
+    #
+    def minSendTime(self, nrNodes, rtol=0.02, start=60000, longest=10**9):
+        known = [t for (n, t) in self.samples if n == nrNodes and self.samples[(n, t)]]
+        t = int(np.median(known)) if known else start
+        good, bad = None, None
+        # bracket: a failing (short) and a passing (long) send time
+        while good is None or bad is None:
+            verdict = self.probe(nrNodes, t)
+            if verdict == 0:
+                return t
+            if verdict > 0:
+                good = t
+                if t == 1:
+                    return t
+                t = max(1, t//4)
+            else:
+                bad = t
+                if t >= longest:
+                    return None
+                t = t*4
+        while good > bad*(1 + rtol) and good - bad > 1:
+            t = int(round(math.sqrt(good*bad)))
+            if t in (good, bad):
+                break
+            verdict = self.probe(nrNodes, t)
+            if verdict == 0:
+                return t
+            if verdict > 0:
+                good = t
+            else:
+                bad = t
+        return good
+
+#
+# most nodes a scenario can have, without one the built-in link losses
+# (the same as scenarios/ufsm.json) limit it
+#
+def nodeLimit(scenario):
+    if scenario is None:
+        scenario = os.path.join(os.path.dirname(loraRun.simulator), 'scenarios', 'ufsm.json')
+    pop = loraScenario.loadScenario(scenario)['nodes']
+    if pop['model'] == 'measured':
+        return len(pop['linkLoss_dB'])
+    return 100000
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 6 or args[1] not in ['nodes', 'sendtime']:
+        print "usage: ./loraCapacity.py nodes targetDER avgSendTime payloadSize experimentNr [--options]"
+        print "       ./loraCapacity.py sendtime targetDER nrNodes payloadSize experimentNr [--options]"
+        exit(-1)
+    search = capacitySearch(int(args[4]), int(args[5]), float(args[2]),
+                            simtime=int(opts.get('simtime', 3600000)),
+                            full_collision=bool(int(opts.get('collision', 0))),
+                            scenario=opts.get('scenario'),
+                            maxReps=int(opts.get('reps', 10)),
+                            z=float(opts.get('z', 1.96)),
+                            engine=opts.get('engine', 'simpy'))
+    if args[1] == 'nodes':
+        avgSendTime = int(args[3])
+        limit = int(opts.get('maxnodes', nodeLimit(search.scenario)))
+        n = search.maxNodes(avgSendTime, limit)
+        print "max nodes:", n
+        if n:
+            print "DER at {} nodes: {:.4f}".format(n, search.estimate(n, avgSendTime))
+    else:
+        nrNodes = int(args[3])
+        t = search.minSendTime(nrNodes, float(opts.get('rtol', 0.02)))
+        print "min avgSendTime:", t
+        if t:
+            print "DER at {} ms: {:.4f}".format(t, search.estimate(nrNodes, t))
+    print "new simulations:", search.simulations
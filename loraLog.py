@@ -0,0 +1,212 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Per packet outcome log for LoRaSim
+
+ A log is a directory with one raw binary file per column (fixed width, see
+ columns) and log.json with the column types and the number of rows. The
+ files are memory-mapped while writing and grow by whole chunks of rows, so
+ a log of any length costs a chunk of memory; close() trims them to the
+ rows written. openLog() maps them back as NumPy arrays without reading
+ them.
+
+ One row per packet in order of start time (loraSweep.py --log=dir; with
+ --window the rows are written window by window as the packets are done,
+ see loraSweep.stream(), so the run takes memory for a window only). The
+ packets a packet overlapped (same receive set, interfering channel) are
+ counted in 'overlaps' and listed, as rows in ascending order, in the
+ overlap table overlap.bin: those of row i are overlap[overlapStart[i]:
+ overlapStart[i] + overlaps[i]]. The table grows by chunks like the
+ columns. 'culprit' is the row of the packet it was lost to, the earliest
+ one if there were several, -1 for none. Reasons:
+
+    0 received      no collision (it counts as received)
+    1 sensitivity   the rssi is below the sensitivity, no gateway hears it
+    2 collision     same SF, simplified collision check
+    3 capture       same SF, full check: a later packet started within the
+                    critical part of the preamble and was not 6 dB weaker
+    4 rejection     a packet with another SF was on air and stronger by more
+                    than the rejection threshold
+    5 unfinished    still on air at the end of the run, not counted
+
+ The demodulator limit (maxBSReceives) does not lose packets in the
+ simulator, it only keeps them from counting as processed: see the
+ 'processed' column.
+"""
+"""
+ SYNOPSIS:
+   ./loraLog.py <dir> [--packet=N]
+ DESCRIPTION:
+    prints the number of packets per reason and per SF, or with --packet
+    the row of one packet, the rows it overlapped and the row of the packet
+    it was lost to.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+reasons = ['received', 'sensitivity', 'collision', 'capture', 'rejection', 'unfinished']
+RECEIVED, SENSITIVITY, COLLISION, CAPTURE, REJECTION, UNFINISHED = range(len(reasons))
+
+columns = [
+    ('cfg', 'i4'),          # configuration (bundle*reps + replication) of the run
+    ('node', 'i4'),
+    ('start', 'f8'),        # ms
+    ('end', 'f8'),
+    ('sf', 'i1'),
+    ('bw', 'i2'),
+    ('freq', 'i4'),
+    ('rssi', 'f4'),
+    ('gw', 'i2'),
+    ('processed', 'i1'),
+    ('reason', 'i1'),
+    ('culprit', 'i8'),
+    ('overlaps', 'i4'),
+    ('overlapStart', 'i8'), # first entry of the row in the overlap table
+]
+
+# entries of the overlap table, rows of the log
+overlapType = 'i8'
+
+class packetLog():
+    def __init__(self, directory, chunk=1 << 20):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.chunk = chunk
+        self.count = 0
+        self.capacity = 0
+        self.maps = {}
+        for name, dtype in columns:
+            open(self.path(name), 'wb').close()
+        # entries in the overlap table and room for them
+        self.pairs = 0
+        self.pairCapacity = 0
+        self.overlap = None
+        open(self.path('overlap'), 'wb').close()
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    # room for at least size rows, in whole chunks
+    def grow(self, size):
+        capacity = -(-size//self.chunk)*self.chunk
+        self.maps = {}
+        for name, dtype in columns:
+            with open(self.path(name), 'r+b') as f:
+                f.truncate(capacity*np.dtype(dtype).itemsize)
+            self.maps[name] = np.memmap(self.path(name), dtype=dtype, mode='r+', shape=(capacity,))
+        self.capacity = capacity
+
+    # add the overlapped rows of rows with the given overlap counts to the
+    # overlap table, one after the other; returns where each one starts
+    def addOverlap(self, overlap, counts):
+        starts = self.pairs + np.cumsum(counts) - counts
+        n = len(overlap)
+        if n == 0:
+            return starts
+        if self.pairs + n > self.pairCapacity:
+            capacity = -(-(self.pairs + n)//self.chunk)*self.chunk
+            self.overlap = None
+            with open(self.path('overlap'), 'r+b') as f:
+                f.truncate(capacity*np.dtype(overlapType).itemsize)
+            self.overlap = np.memmap(self.path('overlap'), dtype=overlapType, mode='r+',
+                                     shape=(capacity,))
+            self.pairCapacity = capacity
+        self.overlap[self.pairs:self.pairs + n] = overlap
+        self.pairs += n
+        return starts
+
+    # append rows given as one array per column (all but overlapStart) and
+    # the rows they overlapped, row after row
+    def append(self, rows, overlap):
+        n = len(rows['node'])
+        if self.count + n > self.capacity:
+            self.grow(self.count + n)
+        rows = dict(rows, overlapStart=self.addOverlap(overlap, rows['overlaps']))
+        for name, dtype in columns:
+            self.maps[name][self.count:self.count + n] = rows[name]
+        self.count += n
+
+    # write rows as append() does, at the row numbers at, in any order; the
+    # log ends after the highest row written
+    def write(self, at, rows, overlap):
+        if len(at) == 0:
+            return
+        top = int(np.max(at)) + 1
+        if top > self.capacity:
+            self.grow(top)
+        rows = dict(rows, overlapStart=self.addOverlap(overlap, rows['overlaps']))
+        for name, dtype in columns:
+            self.maps[name][at] = rows[name]
+        self.count = max(self.count, top)
+
+    def close(self):
+        for m in self.maps.values() + [self.overlap]:
+            if m is not None:
+                m.flush()
+        self.maps = {}
+        self.overlap = None
+        for name, dtype in columns + [('overlap', overlapType)]:
+            with open(self.path(name), 'r+b') as f:
+                f.truncate((self.pairs if name == 'overlap' else self.count)*np.dtype(dtype).itemsize)
+        with open(os.path.join(self.directory, 'log.json'), 'w') as f:
+            json.dump({'rows': self.count, 'columns': columns, 'reasons': reasons,
+                       'overlap': {'entries': self.pairs, 'type': overlapType}}, f, indent=4)
+
+#
+# the columns of a closed log, and the overlap table as 'overlap', as
+# read-only memory-mapped arrays
+#
+def openLog(directory):
+    with open(os.path.join(directory, 'log.json')) as f:
+        meta = json.load(f)
+    table = meta.get('overlap', {'entries': 0, 'type': overlapType})
+    log = {}
+    for name, dtype, size in [(name, dtype, meta['rows']) for name, dtype in meta['columns']] + \
+                             [('overlap', table['type'], table['entries'])]:
+        if size == 0:
+            log[name] = np.zeros(0, dtype=dtype)
+        else:
+            log[name] = np.memmap(os.path.join(directory, name + '.bin'), dtype=dtype,
+                                  mode='r', shape=(size,))
+    return log
+
+# rows the packet in row i overlapped
+def overlapped(log, i):
+    start = log['overlapStart'][i]
+    return log['overlap'][start:start + log['overlaps'][i]]
+
+def printRow(log, i):
+    print ' '.join('{}={}'.format(name, log[name][i]) for name, dtype in columns), \
+        '({})'.format(reasons[log['reason'][i]])
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 2:
+        print "usage: ./loraLog.py dir [--packet=N]"
+        exit(-1)
+    log = openLog(args[1])
+    if 'packet' in opts:
+        i = int(opts['packet'])
+        printRow(log, i)
+        print "overlapped:", ' '.join(str(j) for j in overlapped(log, i)) or '-'
+        if log['culprit'][i] >= 0:
+            printRow(log, log['culprit'][i])
+        exit(0)
+    print "packets:", len(log['node'])
+    for cfg in np.unique(log['cfg']):
+        mine = np.asarray(log['cfg']) == cfg
+        counts = np.bincount(log['reason'][mine], minlength=len(reasons))
+        sfCounts = [np.bincount(log['reason'][mine & (np.asarray(log['sf']) == sf)],
+                                minlength=len(reasons)) for sf in range(6, 13)]
+        print "configuration", cfg
+        print "%8s" % "" + "".join("%12s" % r for r in reasons)
+        print "%8s" % "all" + "".join("%12d" % c for c in counts)
+        for sf, c in zip(range(6, 13), sfCounts):
+            if c.sum():
+                print "%8s" % ("SF%d" % sf) + "".join("%12d" % v for v in c)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Gateway placement for LoRaSim
+
+ Chooses K gateway sites out of a set of candidates for the node population
+ of a scenario. The path loss of every node to every candidate is computed
+ once as a matrix; a placement is scored by serving every node from its best
+ chosen site, configuring the nodes as the experiment does
+ (loraScenario.configureNodes) and predicting the DER analytically:
+
+    a packet of node i with airtime T_i survives when no other node j
+    heard by the same gateway on the same channel and SF starts a packet
+    within T_i + T_j, with the nodes sending 1/(avgSendTime + T_j) packets
+    per ms: p_i = exp(-sum_j (T_i + T_j)/(avgSendTime + T_j)). It is also
+    lost when it starts while a packet with another SF is on air that is
+    stronger by the rejection threshold, which node j is a fraction
+    T_j/(avgSendTime + T_j) of the time.
+
+ This is the simplified collision check; the capture effect of the full
+ check only improves on it. Packets of nodes out of reach count as lost, so
+ the predicted DER includes the coverage.
+
+ The search is greedy (add the best site K times) followed by a local search
+ that swaps a chosen site for another while that improves the score. The
+ scores of the placements of a step are computed in parallel. The final
+ choice is written as a scenario file and confirmed by simulations on node
+ placements drawn with the optimised seed and the following ones.
+"""
+"""
+ SYNOPSIS:
+   ./loraPlacement.py <scenario> <K> <nodes> <avgsend> <payload> <experiment> [--options]
+ DESCRIPTION:
+    options
+        --candidates=file   JSON list of candidate sites {"x": .., "y": ..}
+                            (default: "candidates" of the scenario, else a grid)
+        --grid=16           grid of 16 x 16 candidate sites over the area of
+                            the nodes; the gateways of the scenario are
+                            candidates as well
+        --objective=der     der or coverage
+        --rounds=20         maximum rounds of the local search
+        --workers=N         parallel scoring processes (default: all cores)
+        --seed=0            node placement the search optimises for
+        --confirm=5         simulations of the final choice, 0 for none
+        --engine=sweep      engine of loraRun.py for them
+        --simtime=3600000   simulated time of a confirmation run (ms)
+        --collision=0       full collision check in the confirmation runs
+        --out=file          scenario file of the final choice
+                            (default <scenario>-<K>gw.json)
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import loraRun
+import loraScenario
+
+class placementProblem():
+    def __init__(self, scenario, sites, nrNodes, avgSendTime, payloadSize, experiment,
+                 objective='der', seed=0):
+        pop = scenario['nodes']
+        if pop['model'] == 'measured':
+            raise ValueError("measured link losses cannot be moved to other sites")
+        self.scenario = scenario
+        self.sites = np.asarray(sites, dtype=float)
+        self.nrNodes = nrNodes
+        self.avgSendTime = float(avgSendTime)
+        self.payloadSize = payloadSize
+        self.experiment = experiment
+        self.objective = objective
+        self.seed = seed
+        gws = scenario['gateways']
+        # the nodes stay where they are when the gateways move
+        self.center = pop.get('center', [gws[0]['x'], gws[0]['y']])
+        rng = np.random.RandomState(seed)
+        self.x, self.y, lpl = loraScenario.placeNodes(scenario, nrNodes, rng)
+        self.loss = loraScenario.pathLoss(pop['pathloss'], self.x, self.y,
+                                          self.sites[:, 0], self.sites[:, 1], rng)
+        self.channels = np.array(sorted(scenario['channels']))
+        self.rejection = scenario['rejection']
+
+    #
+    # score, coverage (fraction of nodes reaching a gateway) and predicted
+    # DER of a placement, a list of site indices
+    #
+    def evaluate(self, chosen):
+        loss = self.loss[:, chosen]
+        gw = np.argmin(loss, axis=1)
+        lpl = loss[np.arange(self.nrNodes), gw]
+        sf, bw, cr, txpow, rssi, freq, sensitivity, rectime = loraScenario.configureNodes(
+            self.scenario, lpl, self.payloadSize, self.experiment, np.random.RandomState(self.seed))
+        reach = rssi >= sensitivity
+        rate = 1.0/(self.avgSendTime + rectime)
+        onAir = rate*rectime
+        # nodes that can collide: same gateway and channel (cell) and SF
+        cell = gw*len(self.channels) + np.searchsorted(self.channels, freq)
+        group = cell*7 + sf - 6
+        group[~reach] = -1
+        ids, group = np.unique(group, return_inverse=True)
+        load = np.bincount(group, rate)
+        busy = np.bincount(group, onAir)
+        exposure = rectime*(load[group] - rate) + busy[group] - onAir
+        # a packet starting while a packet with another SF is on air that
+        # is stronger by the rejection threshold is lost as well
+        cell[~reach] = -1
+        key = cell*1000.0 + rssi + 500
+        for b in np.unique(sf[reach]):
+            src = np.nonzero(reach & (sf == b))[0]
+            order = np.argsort(key[src])
+            keys = key[src][order]
+            above = np.r_[np.cumsum(onAir[src][order][::-1])[::-1], 0]
+            cellEnd = np.searchsorted(keys, cell*1000.0 + 1000)
+            for a in np.unique(sf[reach]):
+                if a == b:
+                    continue
+                vic = np.nonzero(reach & (sf == a))[0]
+                thr = self.rejection[a - 7][b - 6]
+                first = np.searchsorted(keys, key[vic] + thr, side='right')
+                exposure[vic] += above[first] - above[cellEnd[vic]]
+        survive = np.where(reach, np.exp(-exposure), 0.0)
+        coverage = reach.mean()
+        der = np.sum(rate*survive)/np.sum(rate)
+        return (der if self.objective == 'der' else coverage), coverage, der
+
+    # scenario with the chosen gateways and the same node population
+    def scenarioFor(self, chosen, name):
+        scenario = dict(self.scenario)
+        scenario['name'] = name
+        scenario['gateways'] = [{'x': float(self.sites[c, 0]), 'y': float(self.sites[c, 1])}
+                                for c in chosen]
+        scenario['nodes'] = dict(scenario['nodes'], center=list(self.center))
+        scenario.pop('candidates', None)
+        return scenario
+
+#
+# candidate sites: the gateways of the scenario, then the given ones or a
+# grid over the area of the nodes
+#
+def candidateSites(scenario, nrNodes, grid=16, fname=None, seed=0):
+    sites = [[g['x'], g['y']] for g in scenario['gateways']]
+    if fname is not None:
+        with open(fname) as f:
+            sites += [[c['x'], c['y']] for c in json.load(f)]
+    elif 'candidates' in scenario:
+        sites += [[c['x'], c['y']] for c in scenario['candidates']]
+    else:
+        x, y, lpl = loraScenario.placeNodes(scenario, nrNodes, np.random.RandomState(seed))
+        gx = np.linspace(x.min(), x.max(), 2*grid + 1)[1::2]
+        gy = np.linspace(y.min(), y.max(), 2*grid + 1)[1::2]
+        sites += [[a, b] for a in gx for b in gy]
+    return np.array(sites, dtype=float)
+
+# the problem of the scoring processes, inherited when they are forked
+problem = None
+
+def score(chosen):
+    return problem.evaluate(chosen)[0]
+
+#
+# scores of many placements, on a pool of processes if there is one
+#
+class scorer():
+    def __init__(self, prob, workers):
+        global problem
+        problem = prob
+        self.problem = prob
+        self.pool = multiprocessing.Pool(workers) if workers > 1 else None
+        self.evaluations = 0
+
+    def __call__(self, placements):
+        self.evaluations += len(placements)
+        if self.pool is None:
+            return np.array([score(p) for p in placements])
+        chunk = max(1, len(placements)//(4*self.pool._processes))
+        return np.array(self.pool.map(score, placements, chunk))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+def greedy(nrSites, K, scores):
+    chosen = []
+    for k in range(K):
+        rest = [c for c in range(nrSites) if c not in chosen]
+        s = scores([chosen + [c] for c in rest])
+        chosen.append(rest[int(np.argmax(s))])
+    return chosen
+
+#
+# best improving swap of one chosen site per round
+#
+def localSearch(nrSites, chosen, scores, rounds=20):
+    best = scores([chosen])[0]
+    for r in range(rounds):
+        moves = [chosen[:i] + [c] + chosen[i+1:]
+                 for i in range(len(chosen)) for c in range(nrSites) if c not in chosen]
+        if not moves:
+            break
+        s = scores(moves)
+        j = int(np.argmax(s))
+        if s[j] <= best + 1e-12:
+            break
+        chosen, best = moves[j], s[j]
+    return chosen, best
+
+def placeGateways(prob, K, workers=1, rounds=20):
+    scores = scorer(prob, workers)
+    try:
+        chosen = greedy(len(prob.sites), K, scores)
+        chosen, best = localSearch(len(prob.sites), chosen, scores, rounds)
+    finally:
+        scores.close()
+    return chosen, scores.evaluations
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 7:
+        print "usage: ./loraPlacement.py scenario K nrNodes avgSendTime payloadSize experimentNr [--options]"
+        exit(-1)
+    fname = args[1]
+    K = int(args[2])
+    nrNodes = int(args[3])
+    avgSendTime = int(args[4])
+    payloadSize = int(args[5])
+    experiment = int(args[6])
+    seed = int(opts.get('seed', 0))
+    scenario = loraScenario.loadScenario(fname)
+    sites = candidateSites(scenario, nrNodes, int(opts.get('grid', 16)), opts.get('candidates'), seed)
+    prob = placementProblem(scenario, sites, nrNodes, avgSendTime, payloadSize, experiment,
+                            opts.get('objective', 'der'), seed)
+
+    start = time.time()
+    chosen, evaluations = placeGateways(prob, K, int(opts.get('workers', multiprocessing.cpu_count())),
+                                        int(opts.get('rounds', 20)))
+    print "candidates: {}, placements scored: {}, {:.1f} s".format(
+        len(sites), evaluations, time.time() - start)
+    baseline = range(len(scenario['gateways']))
+    for label, placement in [('scenario', baseline), ('chosen', chosen)]:
+        s, coverage, der = prob.evaluate(placement)
+        print "{} gateways: coverage {:.4f}, predicted DER {:.4f}".format(label, coverage, der)
+    for c in chosen:
+        print "site {}: x {:.1f} y {:.1f}".format(c, sites[c, 0], sites[c, 1])
+
+    name = '{}-{}gw'.format(scenario['name'], K)
+    out = opts.get('out', os.path.join(os.path.dirname(os.path.abspath(fname)), name + '.json'))
+    with open(out, 'w') as f:
+        json.dump(prob.scenarioFor(chosen, name), f, indent=4)
+    print "scenario:", out
+
+    confirm = int(opts.get('confirm', 5))
+    der = []
+    for rep in range(confirm):
+        res = loraRun.runSimulation(nrNodes, avgSendTime, payloadSize, experiment,
+                                    int(opts.get('simtime', 3600000)),
+                                    bool(int(opts.get('collision', 0))), seed=seed + rep,
+                                    scenario=out, engine=opts.get('engine', 'sweep'))
+        der.append(res['received']/float(res['sent']) if res['sent'] else 0.0)
+        print "seed {}: sent {} received {} lost {} DER {:.4f}".format(
+            seed + rep, res['sent'], res['received'], res['lost'], der[-1])
+    if der:
+        print "simulated DER: {:.4f} +- {:.4f}".format(np.mean(der), np.std(der))
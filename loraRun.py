@@ -0,0 +1,280 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Run LoRaSim from Python
+
+ runSimulation() runs one simulation and returns its counters as a dict with
+ the keys sent, collisions, received, processed, lost, energy and walltime
+ (seconds). The engine is chosen by name from the engines table:
+
+    simpy         the reference discrete event simulator, loraSim_noprint.py,
+                  run in a separate interpreter
+    simpy-warm    the same simulator run inside the calling interpreter, which
+                  saves the start-up of a new one (used by worker processes)
+    sweep         the array engine of loraSweep.py, on the scenario bundle (the
+                  built-in link losses, scenarios/ufsm.json, without a scenario),
+                  compiled when Numba is installed
+    sweep-python  the same, always with the Python sweep
+    slotted       the approximate engine of loraSlotted.py (simplified
+                  collision check only); its result also has 'bound'. Its
+                  runs are not recorded (see approximateEngines)
+    stream        the sweep engine in windows of simulated time
+                  (loraSweep.stream()), for long runs; same model as sweep,
+                  other draws
+
+ An engine is a function taking the parameters as a dict and returning the
+ counters. Extra command line options of loraSim_noprint.py (e.g. '--sinr')
+ are passed in 'options'.
+
+ Every run is appended to the run table runs.txt (one comma separated line
+ per run, see runColumns); loadRuns() reads it back for the tools that learn
+ from past runs. Runs of approximate engines are not: their results are
+ biased and would mix with the others there.
+
+ Runs with a seed are looked up in the result cache (loraCache.py) first; a
+ cached result is returned with 'cached' set and its original walltime,
+ and it is not recorded again. The simulator itself is then run with
+ --nocache, the lookup is done here.
+"""
+
+import os
+import random
+import runpy
+import subprocess
+import sys
+import time
+from StringIO import StringIO
+
+import numpy as np
+
+import loraCache
+import loraScenario
+import loraSlotted
+import loraSweep
+
+simulator = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loraSim_noprint.py')
+
+# table of all runs, None to not record them
+runsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs.txt')
+
+runColumns = ['nrNodes', 'avgSendTime', 'payloadSize', 'experiment', 'simtime',
+              'full_collision', 'seed', 'sent', 'collisions', 'received', 'processed',
+              'lost', 'energy', 'walltime', 'engine', 'options', 'scenario']
+
+# cache of the results of runs with a seed, None to always run
+resultCache = loraCache.resultCache()
+
+# engines whose results are approximations of the model, with a bias (see
+# loraSlotted.py); they are not recorded and loadRuns() skips them
+approximateEngines = ['slotted']
+
+# lines of the simulator output holding the counters
+outputKeys = [
+    ('energy (in J): ', 'energy', float),
+    ('sent packets: ', 'sent', int),
+    ('collisions: ', 'collisions', int),
+    ('received packets: ', 'received', int),
+    ('processed packets: ', 'processed', int),
+    ('lost packets: ', 'lost', int),
+]
+
+# printed as well when the scenario limits the duty cycle or confirms uplinks
+optionalKeys = [
+    ('deferred packets: ', 'deferred', int),
+    ('deferral (in ms): ', 'delay', float),
+    ('dropped packets: ', 'dropped', int),
+    ('acknowledged packets: ', 'acked', int),
+    ('failed packets: ', 'failed', int),
+    ('retransmissions: ', 'retransmissions', int),
+    ('acks sent: ', 'acks', int),
+    ('deaf losses: ', 'deaf', int),
+]
+
+def simulatorArgs(params):
+    args = [str(params['nrNodes']), str(params['avgSendTime']), str(params['payloadSize']),
+            str(params['experiment']), str(params['simtime']), str(int(params['full_collision']))]
+    args += list(params['options'])
+    if params['seed'] is not None:
+        args.append('--seed={}'.format(params['seed']))
+    if params['scenario'] is not None:
+        args.append('--scenario={}'.format(os.path.abspath(params['scenario'])))
+    args += ['--nosave', '--nocache']
+    return args
+
+def parseOutput(text):
+    result = {}
+    for line in text.splitlines():
+        for prefix, key, conv in outputKeys + optionalKeys:
+            if line.startswith(prefix):
+                result[key] = conv(line[len(prefix):])
+    missing = [key for prefix, key, conv in outputKeys if key not in result]
+    if missing:
+        raise RuntimeError("simulator output lacks {}:\n{}".format(', '.join(missing), text[-2000:]))
+    return result
+
+def simpyEngine(params):
+    cmd = [sys.executable, simulator] + simulatorArgs(params)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError("{} failed:\n{}".format(' '.join(cmd), out[-2000:]))
+    return parseOutput(out)
+
+#
+# run loraSim_noprint.py with the given arguments in this interpreter and
+# return its output
+#
+def runScript(args):
+    if '--seed' not in ' '.join(args):
+        # forked workers share the state of their parent, draw a fresh one
+        random.seed()
+        np.random.seed()
+    scriptDir = os.path.dirname(simulator)
+    if scriptDir not in sys.path:
+        sys.path.insert(0, scriptDir)
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = [simulator] + args
+    sys.stdout = StringIO()
+    try:
+        runpy.run_path(simulator, run_name='__main__')
+    except SystemExit:
+        raise RuntimeError("{} failed:\n{}".format(' '.join(args), sys.stdout.getvalue()[-2000:]))
+    finally:
+        out = sys.stdout.getvalue()
+        sys.argv, sys.stdout = argv, stdout
+    return out
+
+def warmEngine(params):
+    return parseOutput(runScript(simulatorArgs(params)))
+
+def sweepEngine(params, jit=None):
+    if modelOptions(params['options']):
+        raise ValueError("sweep engine does not support {}".format(' '.join(params['options'])))
+    scenario = params['scenario'] or loraSweep.defaultScenario
+    bundle = loraScenario.openBundle(scenario, params['nrNodes'], params['payloadSize'],
+                                     params['experiment'], params['seed'])[0]
+    return loraSweep.simulate([bundle], params['avgSendTime'], params['simtime'],
+                              params['full_collision'], params['seed'], jit)[0]
+
+def pythonSweepEngine(params):
+    return sweepEngine(params, jit=False)
+
+def streamEngine(params):
+    if modelOptions(params['options']):
+        raise ValueError("stream engine does not support {}".format(' '.join(params['options'])))
+    scenario = params['scenario'] or loraSweep.defaultScenario
+    bundle = loraScenario.openBundle(scenario, params['nrNodes'], params['payloadSize'],
+                                     params['experiment'], params['seed'])[0]
+    return loraSweep.stream(bundle, params['avgSendTime'], params['simtime'], None,
+                            params['full_collision'], params['seed'])
+
+def slottedEngine(params):
+    if modelOptions(params['options']) or params['full_collision']:
+        raise ValueError("slotted engine has no capture effect or simulator options")
+    scenario = params['scenario'] or loraSweep.defaultScenario
+    bundle = loraScenario.openBundle(scenario, params['nrNodes'], params['payloadSize'],
+                                     params['experiment'], params['seed'])[0]
+    return loraSlotted.simulate(bundle, params['avgSendTime'], params['simtime'], seed=params['seed'])
+
+engines = {
+    'simpy': simpyEngine,
+    'simpy-warm': warmEngine,
+    'sweep': sweepEngine,
+    'sweep-python': pythonSweepEngine,
+    'slotted': slottedEngine,
+    'stream': streamEngine,
+}
+
+# options that change the results, in a canonical order
+modelOptions = loraCache.modelOptions
+
+# engines that give the same results share cache entries
+cacheEngines = {
+    'simpy-warm': 'simpy',
+    'sweep-python': 'sweep',
+}
+
+# name of the engines giving the same results as this one; runs of the same
+# class may be used in place of each other
+def engineClass(engine):
+    return cacheEngines.get(engine, engine)
+
+# key of a run in the result cache, None if it is not cached
+def cacheKey(params, engine):
+    return loraCache.runKey(engineClass(engine), params)
+
+def recordRun(params, result, engine, fname=None):
+    fname = fname or runsFile
+    row = dict(params)
+    row.update(result)
+    row['full_collision'] = int(params['full_collision'])
+    row['seed'] = '-' if params['seed'] is None else params['seed']
+    row['engine'] = engine
+    row['options'] = ' '.join(modelOptions(params['options'])) or '-'
+    row['scenario'] = params['scenario'] or '-'
+    line = ','.join(str(row[c]) for c in runColumns) + "\n"
+    if not os.path.isfile(fname):
+        line = "%#" + ' '.join(runColumns) + "\n" + line
+    # a single write in append mode, so concurrent runs do not interleave
+    with open(fname, 'a') as f:
+        f.write(line)
+
+#
+# the recorded runs; rows of approximate engines (from tables of older
+# versions) only with approximate set
+#
+def loadRuns(fname=None, approximate=False):
+    fname = fname or runsFile
+    runs = []
+    if not os.path.isfile(fname):
+        return runs
+    with open(fname) as f:
+        for line in f:
+            if line.startswith('%') or not line.strip():
+                continue
+            values = line.rstrip('\n').split(',')
+            run = dict(zip(runColumns, values))
+            if run['engine'] in approximateEngines and not approximate:
+                continue
+            for c in ['nrNodes', 'avgSendTime', 'payloadSize', 'experiment', 'simtime',
+                      'sent', 'collisions', 'received', 'processed', 'lost']:
+                run[c] = int(run[c])
+            run['full_collision'] = bool(int(run['full_collision']))
+            run['seed'] = None if run['seed'] == '-' else int(run['seed'])
+            run['energy'] = float(run['energy'])
+            run['walltime'] = float(run['walltime'])
+            run['options'] = () if run['options'] == '-' else tuple(run['options'].split(' '))
+            run['scenario'] = None if run['scenario'] == '-' else run['scenario']
+            runs.append(run)
+    return runs
+
+def runSimulation(nrNodes, avgSendTime, payloadSize, experiment, simtime,
+                  full_collision=False, seed=None, scenario=None, engine='simpy',
+                  options=(), record=True, cache=True):
+    params = {
+        'nrNodes': nrNodes,
+        'avgSendTime': avgSendTime,
+        'payloadSize': payloadSize,
+        'experiment': experiment,
+        'simtime': simtime,
+        'full_collision': bool(full_collision),
+        'seed': seed,
+        'scenario': scenario and os.path.abspath(scenario),
+        'options': tuple(options),
+    }
+    key = None
+    if cache and resultCache is not None:
+        key = cacheKey(params, engine)
+    if key is not None:
+        result = resultCache.get(key)
+        if result is not None:
+            result['cached'] = True
+            return result
+    start = time.time()
+    result = engines[engine](params)
+    result['walltime'] = time.time() - start
+    if key is not None:
+        resultCache.put(key, result, dict(params, engine=engine))
+    if record and runsFile is not None and engine not in approximateEngines:
+        recordRun(params, result, engine)
+    return result
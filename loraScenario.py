@@ -0,0 +1,276 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Scenario files for LoRaSim
+
+ A scenario file (JSON, see scenarios/) declares everything about a network
+ that is not a command line argument of the simulator: gateways, the node
+ population, the channel plan, the sensitivity and rejection tables, the
+ radio settings and the traffic model. An optional dutyCycle section limits
+ the airtime of the nodes per sub-band (see dutyCycles()), an optional
+ confirmed section makes the nodes send confirmed uplinks (see
+ loraSim_noprint.py).
+
+ For a given number of nodes, payload size and experiment a scenario is
+ compiled once into a bundle of precomputed arrays (positions, path losses,
+ SF/BW/CR/power assignment, rssi, sensitivity and airtime per node). Bundles
+ are stored as .npy files in a cache directory and memory-mapped by later
+ runs, so every point of a sweep over avgSendTime reuses the same bundle.
+"""
+"""
+ SYNOPSIS:
+   ./loraScenario.py <scenario> <nodes> <payload> <experiment> [seed]
+ DESCRIPTION:
+    compiles the scenario (if not cached yet) and prints the bundle directory
+    and a summary of the node configuration.
+"""
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# bump when the layout or the meaning of the bundle changes
+bundleVersion = 1
+
+cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.scenario-cache')
+
+# per node arrays in a bundle
+nodeFields = ['x', 'y', 'lpl', 'gw', 'sf', 'bw', 'cr', 'txpow', 'rssi', 'freq',
+              'sensitivity', 'rectime']
+
+#
+# airtime of a packet according to LoraDesignGuide_STD.pdf,
+# same as airtime() in loraSim.py but works on arrays
+#
+def airtime(sf, cr, pl, bw):
+    sf = np.asarray(sf, dtype=float)
+    bw = np.asarray(bw, dtype=float)
+    Npream = 8
+    # low data rate optimization mandated for BW125 with SF11 and SF12
+    DE = ((bw == 125) & (sf >= 11)).astype(float)
+    # can only have implicit header with SF6
+    H = (sf == 6).astype(float)
+
+    Tsym = (2.0**sf)/bw
+    Tpream = (Npream + 4.25)*Tsym
+    payloadSymbNB = 8 + np.maximum(np.ceil((8.0*pl-4.0*sf+28+16-20*H)/(4.0*(sf-2*DE)))*(np.asarray(cr)+4), 0)
+    return Tpream + payloadSymbNB*Tsym
+
+def loadScenario(fname):
+    with open(fname) as f:
+        scenario = json.load(f)
+    for key in ['gateways', 'nodes', 'radio', 'channels', 'sensitivity', 'rejection']:
+        if key not in scenario:
+            raise ValueError("scenario {}: missing '{}'".format(fname, key))
+    scenario.setdefault('name', os.path.splitext(os.path.basename(fname))[0])
+    scenario.setdefault('traffic', {'model': 'poisson'})
+    return scenario
+
+#
+# node positions and path loss to every gateway
+#
+def placeNodes(scenario, nrNodes, rng):
+    gws = scenario['gateways']
+    gx = np.array([g['x'] for g in gws], dtype=float)
+    gy = np.array([g['y'] for g in gws], dtype=float)
+    pop = scenario['nodes']
+
+    if pop['model'] == 'measured':
+        # measured link loss to the (single) gateway, the range only places
+        # the node on a circle for plotting
+        if nrNodes > len(pop['linkLoss_dB']):
+            raise ValueError("scenario has measurements for {} nodes only".format(len(pop['linkLoss_dB'])))
+        if len(gws) != 1:
+            raise ValueError("measured link losses need exactly one gateway")
+        a = rng.random_sample(nrNodes)
+        r = 1000.0*np.array(pop['ranges_km'][:nrNodes])
+        x = gx[0] + r*np.cos(2*math.pi*a)
+        y = gy[0] + r*np.sin(2*math.pi*a)
+        lpl = np.array(pop['linkLoss_dB'][:nrNodes], dtype=float).reshape(nrNodes, 1)
+    elif pop['model'] == 'disc':
+        # uniform in a disc, log-distance path loss with log-normal shadowing
+        cx, cy = pop.get('center', [gx[0], gy[0]])
+        a = rng.random_sample(nrNodes)
+        r = pop['radius']*np.sqrt(rng.random_sample(nrNodes))
+        x = cx + r*np.cos(2*math.pi*a)
+        y = cy + r*np.sin(2*math.pi*a)
+        lpl = pathLoss(pop['pathloss'], x, y, gx, gy, rng)
+    else:
+        raise ValueError("unknown node model '{}'".format(pop['model']))
+    return x, y, lpl
+
+#
+# log-distance path loss from nodes (x, y) to gateways (gx, gy), one row per node
+#
+def pathLoss(model, x, y, gx, gy, rng=None):
+    d = np.hypot(x[:, None] - gx[None, :], y[:, None] - gy[None, :])
+    d = np.maximum(d, 1.0)
+    lpl = model['Lpld0'] + 10*model['gamma']*np.log10(d/model['d0'])
+    if model.get('sigma', 0) and rng is not None:
+        lpl = lpl + rng.normal(0, model['sigma'], lpl.shape)
+    return lpl
+
+#
+# radio settings per node, vectorized version of myPacket in loraSim.py.
+# Nodes that reach the gateway with no setting keep SF12/BW125 and will be
+# counted as lost instead of aborting the run.
+#
+def configureNodes(scenario, lpl, payloadSize, experiment, rng):
+    n = len(lpl)
+    radio = scenario['radio']
+    sensi = np.array(scenario['sensitivity'], dtype=float)
+    Ptx = radio['Ptx']
+    GL = radio['GL']
+
+    # random configuration, overridden by most experiments
+    sf = rng.randint(6, 13, n)
+    cr = rng.randint(1, 5, n)
+    bw = np.array([125, 250, 500])[rng.randint(0, 3, n)]
+    txpow = np.zeros(n) + Ptx
+    if experiment in [0, 1]:
+        sf[:], cr[:], bw[:] = 12, 4, 125
+    elif experiment == 2:
+        sf[:], cr[:], bw[:] = 6, 1, 500
+    elif experiment == 4:
+        sf[:], cr[:], bw[:] = 12, 1, 125
+
+    Prx = txpow - GL - lpl
+    if experiment in [3, 4, 5]:
+        # fastest setting with BW125 that is above sensitivity
+        minairtime = np.zeros(n) + np.inf
+        minsensi = np.zeros(n)
+        sf[:], cr[:], bw[:] = 12, 1, 125
+        for i in range(len(sensi)):
+            at = airtime(sensi[i, 0], 1, payloadSize, 125)
+            better = (sensi[i, 1] < Prx) & (at < minairtime)
+            sf[better] = sensi[i, 0]
+            minairtime[better] = at
+            minsensi[better] = sensi[i, 1]
+        if experiment == 5:
+            # reduce the txpower if there's room left
+            reach = np.isfinite(minairtime)
+            txpow[reach] = np.maximum(2, Ptx - np.floor(Prx[reach] - minsensi[reach]))
+            Prx = txpow - GL - lpl
+
+    channels = scenario['channels']
+    if experiment == 1:
+        freq = np.array(channels)[rng.randint(0, len(channels), n)]
+    else:
+        freq = np.zeros(n, dtype=np.int64) + channels[0]
+
+    # SF6 has no measurements, like loraSim.py it gets the last row
+    sensitivity = sensi[sf - 7, np.searchsorted([125, 250, 500], bw) + 1]
+    rectime = airtime(sf, cr, payloadSize, bw)
+    return sf, bw, cr, txpow, Prx, freq, sensitivity, rectime
+
+#
+# compile a scenario into a bundle: a dict of per node arrays plus 'meta'
+#
+def compileScenario(scenario, nrNodes, payloadSize, experiment, seed=0):
+    rng = np.random.RandomState(seed)
+    x, y, lplGw = placeNodes(scenario, nrNodes, rng)
+    # nodes are served by the gateway with the lowest path loss
+    gw = np.argmin(lplGw, axis=1)
+    lpl = lplGw[np.arange(nrNodes), gw]
+    sf, bw, cr, txpow, rssi, freq, sensitivity, rectime = \
+        configureNodes(scenario, lpl, payloadSize, experiment, rng)
+
+    bundle = {
+        'x': x, 'y': y, 'lpl': lplGw, 'gw': gw.astype(np.int32),
+        'sf': sf.astype(np.int32), 'bw': bw.astype(np.int32), 'cr': cr.astype(np.int32),
+        'txpow': txpow.astype(float), 'rssi': rssi.astype(float),
+        'freq': freq.astype(np.int64), 'sensitivity': sensitivity,
+        'rectime': rectime,
+    }
+    bundle['meta'] = {
+        'name': scenario['name'],
+        'nrNodes': nrNodes,
+        'payloadSize': payloadSize,
+        'experiment': experiment,
+        'seed': seed,
+        'radio': scenario['radio'],
+        'traffic': scenario['traffic'],
+        'dutyCycle': scenario.get('dutyCycle'),
+        'confirmed': scenario.get('confirmed'),
+        'gateways': scenario['gateways'],
+        'channels': scenario['channels'],
+        'sensitivity': scenario['sensitivity'],
+        'rejection': scenario['rejection'],
+    }
+    return bundle
+
+#
+# duty cycle limit of every node: the fraction of the time it may send on
+# the sub-band of its channel. The dutyCycle section of a scenario lists the
+# sub-bands as [low, high, fraction] (Hz); channels outside all of them, or
+# all channels without the section, get 1 (no limit). A node keeps its
+# channel, so it uses one sub-band only.
+#
+def dutyCycles(meta, freq):
+    freq = np.asarray(freq)
+    duty = np.ones(len(freq))
+    for low, high, fraction in (meta.get('dutyCycle') or {}).get('bands', []):
+        duty[(freq >= low) & (freq < high)] = fraction
+    return duty
+
+def bundleKey(scenario, nrNodes, payloadSize, experiment, seed):
+    text = json.dumps([bundleVersion, scenario, nrNodes, payloadSize, experiment, seed],
+                      sort_keys=True)
+    return hashlib.sha1(text).hexdigest()
+
+def saveBundle(bundle, path):
+    # write to a temporary directory first, concurrent runs may race
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp = tempfile.mkdtemp(dir=parent)
+    for name in nodeFields:
+        np.save(os.path.join(tmp, name + '.npy'), bundle[name])
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(bundle['meta'], f)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # someone else was faster
+        shutil.rmtree(tmp)
+
+def loadBundle(path):
+    bundle = {}
+    for name in nodeFields:
+        bundle[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+    with open(os.path.join(path, 'meta.json')) as f:
+        bundle['meta'] = json.load(f)
+    return bundle
+
+#
+# bundle for a scenario file, compiled on first use and memory-mapped from
+# the cache afterwards. Without a seed the placement is drawn with seed 0,
+# so runs of the same scenario share one bundle.
+#
+def openBundle(fname, nrNodes, payloadSize, experiment, seed=None, cache=cacheDir):
+    scenario = loadScenario(fname)
+    if seed is None:
+        seed = 0
+    path = os.path.join(cache, bundleKey(scenario, nrNodes, payloadSize, experiment, seed))
+    if not os.path.isdir(path):
+        saveBundle(compileScenario(scenario, nrNodes, payloadSize, experiment, seed), path)
+    return loadBundle(path), path
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print "usage: ./loraScenario.py scenario nrNodes payloadSize experimentNr [seed]"
+        exit(-1)
+    seed = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    bundle, path = openBundle(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), seed)
+    print "bundle:", path
+    reach = bundle['rssi'] >= bundle['sensitivity']
+    print "nodes:", len(bundle['sf']), "reaching a gateway:", int(reach.sum())
+    for s in np.unique(bundle['sf']):
+        print "sf {}: {} nodes, airtime {:.1f} ms".format(
+            s, int((bundle['sf'] == s).sum()), float(np.mean(bundle['rectime'][bundle['sf'] == s])))
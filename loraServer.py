@@ -0,0 +1,236 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Local job server for LoRaSim
+
+ Accepts simulation jobs over HTTP on localhost and runs them on a pool of
+ worker processes (one per core by default). The workers import the
+ simulator's dependencies once and run loraSim_noprint.py in-process, so a
+ job does not pay for a new interpreter. Identical jobs submitted while one
+ is queued or running share that run. Progress and the result are streamed
+ back as one JSON object per line.
+"""
+"""
+ SYNOPSIS:
+   ./loraServer.py [--port=8686] [--workers=N]
+   ./loraServer.py --submit <nodes> <avgsend> <payload> <experiment> <simtime> [collision] [--options]
+ DESCRIPTION:
+    The first form starts the server. The second form submits a job and
+    prints the streamed replies; options other than --port are passed to
+    the simulator (e.g. --seed=1, --scenario=scenarios/ufsm.json, --sinr).
+
+    POST /run with a JSON object holding nrNodes, avgSendTime, payloadSize,
+    experiment and simtime, optionally full_collision, seed, scenario and
+    options (a list of simulator options). The reply is a stream of lines:
+        {"job": key, "shared": false}    accepted, shared if deduplicated
+        {"progress": "..."}              progress report of the simulator
+        {"result": {...}}                counters, see loraRun.py
+        {"error": "..."}                 the run failed
+    GET /status lists the jobs in flight.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import urllib2
+
+import loraRun
+
+defaultPort = 8686
+
+# seconds between progress reports of a job
+progressInterval = 1.0
+
+def warmUp():
+    # import what the simulator needs once per worker
+    import simpy
+    import numpy
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import loraScenario
+
+def runJob(params):
+    return loraRun.runSimulation(engine='simpy-warm', **params)
+
+#
+# turn a request into simulator parameters, the key identifies equal jobs
+#
+def jobParams(request):
+    params = {
+        'nrNodes': int(request['nrNodes']),
+        'avgSendTime': int(request['avgSendTime']),
+        'payloadSize': int(request['payloadSize']),
+        'experiment': int(request['experiment']),
+        'simtime': int(request['simtime']),
+        'full_collision': bool(request.get('full_collision', False)),
+        'seed': request.get('seed'),
+        'scenario': request.get('scenario'),
+        'options': tuple(sorted(request.get('options', []))),
+    }
+    if params['scenario'] is not None:
+        params['scenario'] = os.path.abspath(params['scenario'])
+    for o in params['options']:
+        if o.startswith('--status') or o.startswith('--progress'):
+            raise ValueError("option {} is set by the server".format(o))
+    key = json.dumps(params, sort_keys=True)
+    return params, key
+
+class simJob():
+    def __init__(self, key, statusFile):
+        self.key = key
+        self.statusFile = statusFile
+        self.result = None
+
+class JobServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers):
+        BaseHTTPServer.HTTPServer.__init__(self, address, JobHandler)
+        self.pool = multiprocessing.Pool(workers, initializer=warmUp)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.statusDir = tempfile.mkdtemp(prefix='lorasim-jobs-')
+        self.jobIds = itertools.count()
+
+    #
+    # start a job, or join the one in flight with the same key
+    #
+    def submit(self, params, key):
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None:
+                return job, True
+            statusFile = os.path.join(self.statusDir, 'job{}.status'.format(next(self.jobIds)))
+            job = self.jobs[key] = simJob(key, statusFile)
+            params = dict(params)
+            params['options'] = params['options'] + ('--status=' + statusFile,
+                                                     '--progress={}'.format(progressInterval))
+            done = lambda value: self.finish(job)
+            job.result = self.pool.apply_async(runJob, (params,), callback=done)
+            return job, False
+
+    def finish(self, job):
+        # called by the pool when the job succeeded; failed jobs are
+        # dropped by the handler
+        with self.lock:
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+        if os.path.exists(job.statusFile):
+            os.remove(job.statusFile)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.terminate()
+        shutil.rmtree(self.statusDir, ignore_errors=True)
+
+class JobHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def send(self, obj):
+        self.wfile.write(json.dumps(obj) + "\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_error(404)
+            return
+        with self.server.lock:
+            jobs = [json.loads(key) for key in self.server.jobs]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.send({'jobs': jobs})
+
+    def do_POST(self):
+        if self.path != '/run':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            params, key = jobParams(json.loads(self.rfile.read(length)))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, "bad job: {}".format(e))
+            return
+        job, shared = self.server.submit(params, key)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            self.send({'job': key, 'shared': shared})
+            last = None
+            while not job.result.ready():
+                job.result.wait(progressInterval)
+                line = readStatus(job.statusFile)
+                if line is not None and line != last:
+                    self.send({'progress': line})
+                    last = line
+            try:
+                self.send({'result': job.result.get()})
+            except Exception as e:
+                self.server.finish(job)
+                self.send({'error': str(e)})
+        except socket.error:
+            # the client went away, the job keeps running for the others
+            pass
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s %s\n" % (self.address_string(), format % args))
+
+def readStatus(fname):
+    try:
+        with open(fname) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+#
+# submit a job to a running server, yields the replies as they arrive
+#
+def submit(request, port=defaultPort):
+    req = urllib2.Request('http://127.0.0.1:{}/run'.format(port), json.dumps(request),
+                          {'Content-Type': 'application/json'})
+    reply = urllib2.urlopen(req)
+    for line in iter(reply.readline, ''):
+        yield json.loads(line)
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    port = int(opts.get('port', defaultPort))
+    if 'submit' in opts:
+        if len(args) < 6:
+            print "usage: ./loraServer.py --submit nrNodes avgSendTime payloadSize experimentNr simtime [full_collision] [--options]"
+            exit(-1)
+        request = {
+            'nrNodes': int(args[1]), 'avgSendTime': int(args[2]), 'payloadSize': int(args[3]),
+            'experiment': int(args[4]), 'simtime': int(args[5]),
+            'full_collision': len(args) > 6 and bool(int(args[6])),
+            'options': [],
+        }
+        for a in sys.argv[1:]:
+            name = a[2:].split('=', 1)[0]
+            if name == 'seed':
+                request['seed'] = int(opts['seed'])
+            elif name == 'scenario':
+                request['scenario'] = opts['scenario']
+            elif a.startswith('--') and name not in ['submit', 'port']:
+                request['options'].append(a)
+        for reply in submit(request, port):
+            print json.dumps(reply)
+    else:
+        workers = int(opts.get('workers', multiprocessing.cpu_count()))
+        server = JobServer(('127.0.0.1', port), workers)
+        print "serving on 127.0.0.1:{} with {} workers".format(port, workers)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
@@ -40,6 +40,46 @@
         With the simplified check, two messages collide when they arrive at the
         same time, on the same frequency and spreading factor. The full collision
         check considers the 'capture effect', whereby a collision of one or the
+    options
+        optional settings given as --name or --name=value after the positional
+        arguments:
+        --sinr  use the cumulative interference receiver model: the power of
+                all interferers on a channel is summed (weighted by the capture
+                and SF rejection thresholds) and a packet is lost when its
+                worst SINR during reception falls below the threshold.
+        --scenario=file
+                take gateways, nodes, channels, radio settings and tables from
+                a scenario file (see scenarios/ and loraScenario.py). The node
+                configuration is compiled once and memory-mapped from the
+                cache by later runs. Its traffic section selects the
+                traffic model (see loraTraffic.py), its dutyCycle section
+                makes nodes wait until the sub-band of their channel is
+                open again after a packet (see loraScenario.dutyCycles());
+                deferred and dropped packets are reported. Its confirmed
+                section makes nodes wait for an ACK and retransmit (see
+                confirmedTransmit()), e.g.
+                {"retries": 8, "rx1Delay": 1000, "rx2Delay": 2000,
+                 "rx2": {"sf": 12, "bw": 125}, "ackLength": 13,
+                 "backoff": [1000, 3000]}
+                (the defaults; delays in ms, ackLength in bytes).
+        --seed=N
+                seed the random number generators. A run with a seed is
+                looked up in the result cache first (see loraCache.py) and
+                a stored result is printed instead of running again.
+        --nocache
+                do not use the result cache.
+        --nosave
+                do not append the result to the expX file.
+        --progress=S
+                report progress every S wall seconds on stderr: simulated
+                time, events per second, packets on air and an ETA.
+        --status=file
+                write the progress report to this file instead (the file
+                holds the latest report only).
+        --stats=prefix
+                write per node and per SF statistics (sent, collided, lost,
+                received, processed packets, airtime and energy) as columns
+                to prefix-nodes.txt and prefix-sf.txt.
  OUTPUT
     The result of every simulation run will be appended to a file named expX.dat,
     whereby X is the experiment number. The file contains a space separated table
@@ -52,8 +92,15 @@ import random
 import numpy as np
 import math
 import sys
+import time
 import matplotlib.pyplot as plt
 import os
+from collections import deque
+
+import loraCache
+import loraScenario
+import loraTimers
+import loraTraffic
 
 # turn on/off graphics
 graphics = 0
@@ -61,6 +108,9 @@ graphics = 0
 # do the full collision check   
 full_collision = False
 
+# use the cumulative interference (SINR) receiver model
+sinr_model = False
+
 # experiments:
 # 0: packet with longest airtime, aloha-style experiment
 # 0: one with 3 frequencies, 1 with 1 frequency
@@ -109,7 +159,7 @@ def checkcollision(packet):
     col = 0 # flag needed since there might be several collisions for packet
     processing = 0
     for i in range(0,len(packetsAtBS)):
-        if packetsAtBS[i].packet.processed == 1:
+        if packetsAtBS[i].packet.processed == 1 and packetsAtBS[i].packet.gw == packet.gw:
             processing = processing + 1
     if (processing > maxBSReceives):
         packet.processed = 0
@@ -118,7 +168,8 @@ def checkcollision(packet):
 
     if packetsAtBS:
         for other in packetsAtBS:
-            if other.nodeid != packet.nodeid:
+            # nodes are heard by their own gateway only
+            if other.nodeid != packet.nodeid and other.packet.gw == packet.gw:
                # simple collision
                if frequencyCollision(packet, other.packet):
                    if sfCollision(packet, other.packet):
@@ -209,6 +260,98 @@ def powersfCollision(p1, p2):
     else:
         return False    
 
+#
+# cumulative interference (SINR) receiver model
+#
+# The pairwise checks above miss several weak interferers that together drown
+# a packet. Here every channel keeps a running sum of the received power of
+# the packets on air, one sum per victim SF, with each interferer weighted by
+# the threshold it needs to beat (capture for the same SF, interf otherwise).
+# The sums only grow when a packet starts, so the worst SINR of a packet is
+# the highest sum seen since it started. Those peaks are kept in a stack of
+# groups, newest on top, that are merged (union-find) when a new peak covers
+# them: every event costs amortised constant time.
+#
+class sinrChannel():
+    def __init__(self):
+        self.active = 0
+        self.interference = [0.0] * 7   # weighted sum per victim SF 6..12
+        self.peaks = [deque() for v in range(7)]
+
+class peakGroup():
+    def __init__(self, peak):
+        self.peak = peak
+        self.alive = 1
+        self.parent = None
+
+def findGroup(group):
+    root = group
+    while root.parent is not None:
+        root = root.parent
+    # path compression
+    while group is not root:
+        group.parent, group = root, group.parent
+    return root
+
+def sinrStart(packet):
+    if nrBSProcessing[packet.gw] > maxBSReceives:
+        packet.processed = 0
+    else:
+        packet.processed = 1
+        nrBSProcessing[packet.gw] += 1
+
+    ch = sinrChannels.get((packet.gw, packet.freq))
+    if ch is None:
+        ch = sinrChannels[(packet.gw, packet.freq)] = sinrChannel()
+    ch.active = ch.active + 1
+    packet.power = 10**(packet.rssi/10.0)
+    a = packet.sf - 6
+    for v in range(7):
+        ch.interference[v] += packet.power * sinrWeight[v][a]
+        peaks = ch.peaks[v]
+        if v != a and not peaks:
+            continue
+        level = ch.interference[v]
+        merged = None
+        if v == a:
+            merged = packet.group = peakGroup(level)
+        # all groups whose peak is covered by this level now share it
+        while peaks and peaks[-1].peak <= level:
+            top = peaks.pop()
+            if merged is None:
+                merged = top
+                merged.peak = level
+            else:
+                top.parent = merged
+                merged.alive = merged.alive + top.alive
+        if merged is not None:
+            peaks.append(merged)
+
+def sinrEnd(packet):
+    if packet.processed == 1:
+        nrBSProcessing[packet.gw] -= 1
+
+    ch = sinrChannels[(packet.gw, packet.freq)]
+    a = packet.sf - 6
+    group = findGroup(packet.group)
+    worst = group.peak - packet.power * sinrWeight[a][a]
+    if packet.power < worst:
+        packet.collided = 1
+    group.alive = group.alive - 1
+    packet.group = None
+
+    ch.active = ch.active - 1
+    if ch.active == 0:
+        # start afresh, this also drops any rounding residue
+        ch.interference = [0.0] * 7
+        ch.peaks = [deque() for v in range(7)]
+        return
+    for v in range(7):
+        ch.interference[v] -= packet.power * sinrWeight[v][a]
+    peaks = ch.peaks[a]
+    while peaks and peaks[0].alive == 0:
+        peaks.popleft()
+
 # this function computes the airtime of a packet
 # according to LoraDesignGuide_STD.pdf
 #
@@ -244,12 +387,16 @@ class myNode():
         # this is very complex prodecure for placing nodes
         # and ensure minimum distance between each pair of nodes
         global nodes
-        maxDist  = Ranges_km[nodeid]
-        a = random.random()
-        posx = maxDist*math.cos(2*math.pi*a)+bsx
-        posy = maxDist*math.sin(2*math.pi*a)+bsy
-        self.x = posx
-        self.y = posy
+        if bundle is not None:
+            self.x = nodeConf['x'][nodeid]
+            self.y = nodeConf['y'][nodeid]
+        else:
+            maxDist  = Ranges_km[nodeid]
+            a = random.random()
+            posx = maxDist*math.cos(2*math.pi*a)+bsx
+            posy = maxDist*math.sin(2*math.pi*a)+bsy
+            self.x = posx
+            self.y = posy
         
         # take distance from vector
         self.dist = np.sqrt((self.x-bsx)*(self.x-bsx)+(self.y-bsy)*(self.y-bsy))
@@ -279,6 +426,12 @@ class myPacket():
 
         self.nodeid = nodeid
         self.txpow = Ptx
+        self.gw = 0
+        self.deaf = 0
+
+        if bundle is not None:
+            self.fromBundle(nodeid, plen)
+            return
 
         # randomize configuration values
         self.sf = random.randint(6,12)
@@ -374,89 +527,396 @@ class myPacket():
         # denote if packet is collided
         self.collided = 0
         self.processed = 0
+        # looked up once, nodes below it are never scheduled
+        self.sensitivity = sensi[self.sf - 7, [125,250,500].index(self.bw) + 1]
+
+    # configuration precompiled from a scenario file
+    def fromBundle(self, nodeid, plen):
+        self.txpow = nodeConf['txpow'][nodeid]
+        self.gw = nodeConf['gw'][nodeid]
+        self.sf = nodeConf['sf'][nodeid]
+        self.cr = nodeConf['cr'][nodeid]
+        self.bw = nodeConf['bw'][nodeid]
+        self.transRange = 150
+        self.pl = plen
+        self.symTime = (2.0**self.sf)/self.bw
+        self.arriveTime = 0
+        self.rssi = nodeConf['rssi'][nodeid]
+        self.freq = nodeConf['freq'][nodeid]
+        self.rectime = nodeConf['rectime'][nodeid]
+        self.collided = 0
+        self.processed = 0
+        self.sensitivity = nodeConf['sensitivity'][nodeid]
 
 #
-# main discrete event loop, runs for each node
+# main discrete event loop, runs for each node that reaches the gateway
 # a global list of packet being processed at the gateway
 # is maintained
 #
 def transmit(env,node):
-    while True:
-        yield env.timeout(random.expovariate(1.0/float(node.period)))
+    for wait in sendWaits(node):
+        yield env.timeout(wait)
+
+        # under a duty cycle limit the sub-band may still be closed after
+        # the previous packet (a schedule already keeps to the limit)
+        if dutyCycle is not None and schedule is None:
+            wait = dutyWait(node)
+            if wait > 0:
+                yield env.timeout(wait)
 
-        # time sending and receiving
-        # packet arrives -> add to base station
+        uplinkStart(node)
+        yield env.timeout(node.packet.rectime)
+        uplinkEnd(node)
 
-        node.sent = node.sent + 1
-        if (node in packetsAtBS):
-            print "ERROR: packet already in"
+#
+# time until the sub-band of a node is open again (0 if it is), counted as
+# deferral; dutyWait() also lets the next packet start spacing after this one
+#
+def dutyClosed(node):
+    wait = max(0.0, nodeAllowed[node.nodeid] - env.now)
+    if wait > 0:
+        nodeDeferred[node.nodeid] += 1
+        nodeDelay[node.nodeid] += wait
+    return wait
+
+def dutyWait(node):
+    wait = dutyClosed(node)
+    nodeAllowed[node.nodeid] = env.now + wait + nodeSpacing[node.nodeid]
+    return wait
+
+# time sending and receiving
+# packet arrives -> add to base station
+def uplinkStart(node):
+    node.sent = node.sent + 1
+    if (node in packetsAtBS):
+        print "ERROR: packet already in"
+    else:
+        if sinr_model:
+            # collisions are decided when the packet ends
+            sinrStart(node.packet)
         else:
-            sensitivity = sensi[node.packet.sf - 7, [125,250,500].index(node.packet.bw) + 1]
-            if node.packet.rssi < sensitivity:
-                print "node {}: packet will be lost".format(node.nodeid)
-                node.packet.lost = True
+            # adding packet if no collision
+            if (checkcollision(node.packet)==1):
+                node.packet.collided = 1
             else:
-                node.packet.lost = False
-                # adding packet if no collision
-                if (checkcollision(node.packet)==1):
-                    node.packet.collided = 1
-                else:
-                    node.packet.collided = 0
-                packetsAtBS.append(node)
-                node.packet.addTime = env.now
+                node.packet.collided = 0
+            packetsAtBS.append(node)
+        node.packet.addTime = env.now
+    if confirmed is not None:
+        # a sending gateway does not hear the packet
+        if gwBusy[node.packet.gw] > env.now:
+            node.packet.deaf = 1
+        receiving[node.packet.gw].add(node)
+
+# the packet is over; returns whether the gateway got it
+def uplinkEnd(node):
+    if sinr_model:
+        sinrEnd(node.packet)
+    if confirmed is not None:
+        receiving[node.packet.gw].discard(node)
+        if node.packet.deaf == 1:
+            global nrDeaf
+            nrDeaf = nrDeaf + 1
+            node.packet.collided = 1
+
+    if node.packet.collided == 1:
+        global nrCollisions
+        nrCollisions = nrCollisions +1
+        nodeCollided[node.nodeid] += 1
+    if node.packet.collided == 0:
+        global nrReceived
+        nrReceived = nrReceived + 1
+        nodeReceived[node.nodeid] += 1
+    if node.packet.processed == 1:
+        global nrProcessed
+        nrProcessed = nrProcessed + 1
+        nodeProcessed[node.nodeid] += 1
+    heard = node.packet.collided == 0 and node.packet.processed == 1
+
+    # complete packet has been received by base station
+    # can remove it
+    if (node in packetsAtBS):
+        packetsAtBS.remove(node)
+        # reset the packet
+    node.packet.collided = 0
+    node.packet.processed = 0
+    node.packet.deaf = 0
+    return heard
 
-        yield env.timeout(node.packet.rectime)
+#
+# confirmed uplinks: a gateway that got a packet answers with an ACK in the
+# first receive window (rx1Delay after the end of the packet, at its SF and
+# BW) or, if it is sending then, in the second one (rx2Delay after the end,
+# at the rx2 settings); if it is sending again, the ACK is not sent. While a
+# gateway sends it is deaf: packets on air at it, or starting, are lost. A
+# node that got no ACK by the end of the second window retransmits the
+# packet after a uniform back-off (from the time its sub-band is open again
+# under a duty cycle limit), up to 'retries' times, and then gives up.
+# ACKs do not collide at the nodes and the duty cycle of the gateways is
+# not limited.
+#
+# The receive windows, ACK timeouts and back-offs are timers of one timer
+# wheel (loraTimers.py) run by a single process (runTimers()), not SimPy
+# events: they cost O(1) to schedule and to cancel however many are
+# pending. Nodes below sensitivity are run as well, they retransmit every
+# packet.
+#
+def confirmedTransmit(env,node):
+    reach = node.packet.rssi >= node.packet.sensitivity
+    for wait in sendWaits(node):
+        yield env.timeout(wait)
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                global nrRetransmissions
+                nrRetransmissions = nrRetransmissions + 1
+                nodeRetransmitted[node.nodeid] += 1
+            if dutyCycle is not None:
+                wait = dutyWait(node)
+                if wait > 0:
+                    yield env.timeout(wait)
+
+            if reach:
+                uplinkStart(node)
+                yield env.timeout(node.packet.rectime)
+                if uplinkEnd(node):
+                    setTimer(env.now + rx1Delay, ('rx1', node))
+            else:
+                node.sent = node.sent + 1
+                yield env.timeout(node.packet.rectime)
+                global nrLost
+                nrLost = nrLost + 1
+                nodeLost[node.nodeid] += 1
+
+            # wait for the ACK, at most until just after the second window
+            node.acked = False
+            node.wake = env.event()
+            node.ackTimer = setTimer(env.now + rx2Delay + rx2AckTime + ackGuard, ('wake', node))
+            yield node.wake
+            if node.acked:
+                break
+            if attempt < retries:
+                # back off from when the sub-band is open again: nodes that
+                # collided would reopen together and collide again
+                wait = random.uniform(*backoff)
+                if dutyCycle is not None:
+                    wait += dutyClosed(node)
+                node.wake = env.event()
+                setTimer(env.now + wait, ('wake', node))
+                yield node.wake
+
+        if node.acked:
+            global nrAcked
+            nrAcked = nrAcked + 1
+            nodeAcked[node.nodeid] += 1
+        else:
+            global nrFailed
+            nrFailed = nrFailed + 1
+            nodeFailed[node.nodeid] += 1
+
+# the gateway sends an ACK to node of the given airtime
+def sendAck(node, length):
+    global nrAcks
+    nrAcks = nrAcks + 1
+    gw = node.packet.gw
+    gwBusy[gw] = env.now + length
+    for other in receiving[gw]:
+        other.packet.deaf = 1
+    setTimer(env.now + length, ('ack', node))
+
+def fireTimer(item):
+    kind, node = item
+    if kind == 'wake':
+        node.wake.succeed()
+    elif kind == 'ack':
+        node.acked = True
+        timers.cancel(node.ackTimer)
+        node.wake.succeed()
+    elif gwBusy[node.packet.gw] > env.now:
+        # the gateway is sending, try the second window
+        if kind == 'rx1':
+            setTimer(env.now + rx2Delay - rx1Delay, ('rx2', node))
+    elif kind == 'rx1':
+        sendAck(node, node.ackTime)
+    else:
+        sendAck(node, rx2AckTime)
+
+def setTimer(t, item):
+    timer = timers.schedule(t, item)
+    # runTimers() sleeps until a later timer, wake it up
+    if t < timerDeadline and not timerWake.triggered:
+        timerWake.succeed()
+    return timer
+
+def runTimers(env):
+    global timerDeadline, timerWake
+    while True:
+        t = timers.next()
+        timerWake = env.event()
+        if t is None:
+            timerDeadline = float('inf')
+            yield timerWake
+            continue
+        timerDeadline = t
+        if t > env.now:
+            yield env.timeout(t - env.now) | timerWake
+            if timerWake.triggered:
+                continue
+        for item in timers.expire(t):
+            fireTimer(item)
+
+#
+# waits of a node before each of its packets: exponential gaps after the
+# previous packet for poisson traffic, otherwise up to the next time of its
+# schedule from the scenario's traffic model (at once if that has passed)
+#
+def sendWaits(node):
+    if schedule is None:
+        return interArrivals(float(node.period), arrivalBlock(node))
+    return (max(0.0, t - env.now) for t in schedule[node.nodeid])
+
+#
+# inter-arrival times of a node, drawn from NumPy in blocks and handed out
+# one by one; a Python-level expovariate per packet costs several times
+# more. The blocks come from arrivalRng, so runs with a seed repeat.
+#
+def interArrivals(period, block):
+    while True:
+        for gap in arrivalRng.exponential(period, block).tolist():
+            yield gap
+
+# block size: what the node sends in the whole run, at most 4096
+def arrivalBlock(node):
+    return min(4096, int(simtime/(node.period + node.packet.rectime)) + 16)
+
+#
+# send cycles of a node that never reaches the gateway: an exponential wait
+# followed by the airtime. Such a node cannot disturb anyone, so instead of
+# simulating it the cycle lengths are drawn in blocks (from arrivalRng, not
+# the stream the node positions come from) and only counted.
+# Under a duty cycle limit a cycle lasts 'spacing' at least (but the first).
+# Returns the packets started and the packets completed before 'until', the
+# packets deferred by the duty cycle limit and their total deferral.
+#
+def unreachableSends(period, rectime, until, spacing=None):
+    sent = 0
+    lost = 0
+    deferred = 0
+    delay = 0.0
+    t = 0.0
+    while True:
+        n = int((until - t) / (period + rectime)) + 1
+        n = n + 6*int(math.sqrt(n)) + 10
+        cycles = arrivalRng.exponential(period, n) + rectime
+        extra = np.zeros(n)
+        if spacing is not None:
+            extra = np.maximum(spacing - cycles, 0)
+            if t == 0.0:
+                extra[0] = 0.0
+        ends = t + np.cumsum(cycles + extra)
+        started = np.searchsorted(ends - rectime, until)
+        sent += started
+        lost += np.searchsorted(ends, until)
+        deferred += np.sum(extra[:started] > 0)
+        delay += np.sum(extra[:started])
+        if ends[-1] - rectime >= until:
+            return int(sent), int(lost), int(deferred), float(delay)
+        t = ends[-1]
+
+# the same for a node with a schedule
+def scheduledSends(times, rectime, until):
+    starts = loraTraffic.serialize(np.zeros(len(times), dtype=int), np.array(times), [rectime])
+    return int(np.sum(starts < until)), int(np.sum(starts + rectime < until))
 
-        if node.packet.lost:
-            global nrLost
-            nrLost += 1
-        if node.packet.collided == 1:
-            global nrCollisions
-            nrCollisions = nrCollisions +1
-        if node.packet.collided == 0 and not node.packet.lost:
-            global nrReceived
-            nrReceived = nrReceived + 1
-        if node.packet.processed == 1:
-            global nrProcessed
-            nrProcessed = nrProcessed + 1
-
-        # complete packet has been received by base station
-        # can remove it
-        if (node in packetsAtBS):
-            packetsAtBS.remove(node)
-            # reset the packet
-        node.packet.collided = 0
-        node.packet.processed = 0
-        node.packet.lost = False
+#
+# packets currently on air at the gateway
+#
+def onAir():
+    if sinr_model:
+        return sum(ch.active for ch in sinrChannels.values())
+    return len(packetsAtBS)
+
+def reportProgress(line, statusFile):
+    if statusFile is None:
+        sys.stderr.write(line + "\n")
+        return
+    # replace the file at once so readers never see a partial report
+    with open(statusFile + ".tmp", "w") as f:
+        f.write(line + "\n")
+    os.rename(statusFile + ".tmp", statusFile)
+
+#
+# env.run in chunks of simulated time, reporting every 'interval' wall
+# seconds. The chunk length adapts so that a chunk takes about a tenth of
+# the interval, the overhead is a few calls per report.
+# Every packet is two events (send and end of airtime).
+#
+def runWithProgress(env, until, interval, statusFile):
+    start = time.time()
+    lastReport = start
+    lastEvents = 0
+    chunk = until/1000.0
+    while env.now < until:
+        chunkStart = time.time()
+        env.run(until=min(env.now + chunk, until))
+        now = time.time()
+        if now - chunkStart < interval/20.0:
+            chunk = chunk*2
+        elif now - chunkStart > interval/5.0:
+            chunk = chunk/2
+        if now - lastReport >= interval or env.now >= until:
+            events = 2*sum(n.sent for n in nodes)
+            rate = (events - lastEvents)/(now - lastReport)
+            eta = (now - start)*(until - env.now)/env.now
+            reportProgress("progress: {:5.1f}% sim {:.0f}/{} ms, {:.0f} events/s, {} on air, ETA {:.0f} s".format(
+                100.0*env.now/until, env.now, until, rate, onAir(), eta), statusFile)
+            lastReport = now
+            lastEvents = events
 
 #
 # "main" program
 #
 
-# get arguments
-if len(sys.argv) >= 5:
-    nrNodes = int(sys.argv[1])
-    avgSendTime = int(sys.argv[2])
-    payloadSize = int(sys.argv[3])
-    experiment = int(sys.argv[4])
-    simtime = int(sys.argv[5])
-    if len(sys.argv) > 6:
-        full_collision = bool(int(sys.argv[6]))
+# wall time of the run, kept with its result in the cache
+startTime = time.time()
+
+# get arguments, options are given as --name or --name=value
+opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+args = [a for a in sys.argv if not a.startswith('--')]
+if len(args) >= 6:
+    nrNodes = int(args[1])
+    avgSendTime = int(args[2])
+    payloadSize = int(args[3])
+    experiment = int(args[4])
+    simtime = int(args[5])
+    if len(args) > 6:
+        full_collision = bool(int(args[6]))
+    sinr_model = 'sinr' in opts
+    seed = int(opts['seed']) if 'seed' in opts else None
     print "Nodes:", nrNodes
     print "AvgSendTime (exp. distributed):",avgSendTime
     print "PayloadSize (B):",payloadSize
     print "Experiment: ", experiment
     print "Simtime: ", simtime
     print "Full Collision: ", full_collision
+    print "SINR model: ", sinr_model
+    if 'scenario' in opts:
+        print "Scenario: ", opts['scenario']
 else:
-    print "usage: ./loraSim nrNodes avgSendTime payloadSize experimentNr simtime [full_collision]"
+    print "usage: ./loraSim nrNodes avgSendTime payloadSize experimentNr simtime [full_collision] [--options]"
     print "experiment 0 and 1 use 1 frequency only"
     exit(-1)
 
 
 # global stuff
 #Rnd = random.seed(12345)
+if seed is not None:
+    random.seed(seed)
+    np.random.seed(seed)
+# inter-arrival times, a stream of its own
+arrivalRng = np.random.RandomState(loraTraffic.trafficSeed(seed))
 nodes = []
+unreachable = []
 packetsAtBS = []
 env = simpy.Environment()
 
@@ -474,6 +934,15 @@ nrReceived = 0
 nrProcessed = 0
 nrLost = 0
 
+# per node counters, plain lists because they are updated for every packet
+# (an item of a list is several times cheaper to increment than one of a
+# numpy array); sent packets are counted by the nodes, airtime and energy
+# follow from them
+nodeCollided = [0]*nrNodes
+nodeReceived = [0]*nrNodes
+nodeProcessed = [0]*nrNodes
+nodeLost = [0]*nrNodes
+
 Ptx = 13
 #gamma = 2.08
 gamma = 4
@@ -485,20 +954,87 @@ GL = -15
 
 sensi = np.array([sf7,sf8,sf9,sf10,sf11,sf12])
 interf = np.array([sf7d,sf8d,sf9d,sf10d,sf11d,sf12d])
-if experiment in [0,1,4]:
-    minsensi = sensi[5,2]  # 5th row is SF12, 2nd column is BW125
-elif experiment == 2:
-    minsensi = -112.0   # no experiments, so value from datasheet
-elif experiment == 3:
-    minsensi = np.amin(sensi) ## Experiment 3 can use any setting, so take minimum
-Lpl = Ptx - minsensi
-print "amin", minsensi, "Lpl", Lpl
-maxDist = d0*(math.e**((Lpl-Lpld0)/(10.0*gamma)))
-print "maxDist:", maxDist
-
-# base station placement
-bsx = maxDist+10
-bsy = maxDist+10
+
+# the scenario file replaces the settings above
+bundle = None
+if 'scenario' in opts:
+    bundle, bundlePath = loraScenario.openBundle(opts['scenario'], nrNodes, payloadSize, experiment, seed)
+    print "bundle:", bundlePath
+    meta = bundle['meta']
+    Ptx = meta['radio']['Ptx']
+    GL = meta['radio']['GL']
+    maxBSReceives = meta['radio']['maxBSReceives']
+    sensi = np.array(meta['sensitivity'])
+    interf = np.array(meta['rejection'])
+    nodeConf = dict((k, bundle[k].tolist()) for k in loraScenario.nodeFields)
+
+# duty cycle limit: per node the time from the start of a packet until the
+# sub-band is open again, the earliest next start, and what was deferred or
+# dropped
+dutyCycle = None if bundle is None else meta.get('dutyCycle')
+nodeDeferred = [0]*nrNodes
+nodeDelay = [0.0]*nrNodes
+nodeDropped = [0]*nrNodes
+if dutyCycle is not None:
+    nodeSpacing = (bundle['rectime']/loraScenario.dutyCycles(meta, bundle['freq'])).tolist()
+    nodeAllowed = [0.0]*nrNodes
+
+# SINR model: linear weight of an interferer with SF a on a victim with SF v,
+# the victim survives while its power exceeds the weighted interference sum.
+# SF6 has no measured rejection values, use the ones of SF7.
+sinrWeight = [[10**(-interf[max(v,7)-7, max(a,7)-6]/10.0) for a in range(6,13)]
+              for v in range(6,13)]
+sinrChannels = {}
+# every node is served by one gateway (the one it reaches best), each
+# gateway receives on its own
+nrGateways = 1 if bundle is None else len(meta['gateways'])
+nrBSProcessing = [0]*nrGateways
+
+# confirmed uplinks, see confirmedTransmit()
+confirmed = None if bundle is None else meta.get('confirmed')
+nrAcked = 0
+nrFailed = 0
+nrRetransmissions = 0
+nrAcks = 0
+nrDeaf = 0
+nodeAcked = [0]*nrNodes
+nodeFailed = [0]*nrNodes
+nodeRetransmitted = [0]*nrNodes
+if confirmed is not None:
+    retries = confirmed.get('retries', 8)
+    rx1Delay = confirmed.get('rx1Delay', 1000)
+    rx2Delay = confirmed.get('rx2Delay', 2000)
+    rx2 = confirmed.get('rx2', {'sf': 12, 'bw': 125})
+    ackLength = confirmed.get('ackLength', 13)
+    backoff = confirmed.get('backoff', [1000, 3000])
+    rx2AckTime = airtime(rx2['sf'], 1, ackLength, rx2['bw'])
+    # a node gives up this long after the latest end of an ACK
+    ackGuard = 1.0
+    timers = loraTimers.timerWheel()
+    timerDeadline = float('inf')
+    timerWake = env.event()
+    # end of the ACK a gateway sends, packets on air at a gateway
+    gwBusy = [0.0]*nrGateways
+    receiving = [set() for g in range(nrGateways)]
+if bundle is not None:
+    bsx = meta['gateways'][0]['x']
+    bsy = meta['gateways'][0]['y']
+    maxDist = np.amax(np.hypot(bundle['x'] - bsx, bundle['y'] - bsy))
+else:
+    if experiment in [0,1,4]:
+        minsensi = sensi[5,2]  # 5th row is SF12, 2nd column is BW125
+    elif experiment == 2:
+        minsensi = -112.0   # no experiments, so value from datasheet
+    elif experiment == 3:
+        minsensi = np.amin(sensi) ## Experiment 3 can use any setting, so take minimum
+    Lpl = Ptx - minsensi
+    print "amin", minsensi, "Lpl", Lpl
+    maxDist = d0*(math.e**((Lpl-Lpld0)/(10.0*gamma)))
+    print "maxDist:", maxDist
+
+    # base station placement
+    bsx = maxDist+10
+    bsy = maxDist+10
 xmax = bsx + maxDist + 20
 ymax = bsy + maxDist + 20
 
@@ -512,12 +1048,39 @@ if (graphics == 1):
     ax.add_artist(plt.Circle((bsx, bsy), maxDist, fill=False, color='green'))
 
 
+# packet times of all nodes, unless the traffic is poisson
+schedule = None
+if bundle is not None and meta['traffic']['model'] != 'poisson':
+    trafficNode, trafficTime = loraTraffic.arrivals(meta['traffic'], bundle['x'], bundle['y'],
+                                                    avgSendTime, simtime, arrivalRng)
+    # with confirmed uplinks the nodes keep to the limit as they send, the
+    # retransmissions cannot be planned
+    if dutyCycle is not None and confirmed is None:
+        keep, sendTime, delay = loraTraffic.dutyCycle(trafficNode, trafficTime, bundle['rectime'],
+                                                      nodeSpacing, dutyCycle.get('queue', 1))
+        nodeDropped = np.bincount(trafficNode[~keep], minlength=nrNodes).tolist()
+        trafficNode, trafficTime, delay = trafficNode[keep], sendTime[keep], delay[keep]
+        started = trafficTime < simtime
+        nodeDeferred = np.bincount(trafficNode[started], delay[started] > 0, nrNodes).astype(int).tolist()
+        nodeDelay = np.bincount(trafficNode[started], delay[started], nrNodes).tolist()
+    schedule = np.split(trafficTime, np.searchsorted(trafficNode, np.arange(1, nrNodes)))
+    schedule = [t.tolist() for t in schedule]
+
 for i in range(0,nrNodes):
     # myNode takes period (in ms), base station id packetlen (in Bytes)
     # 1000000 = 16 min
     node = myNode(i,bsId, avgSendTime,payloadSize)
     nodes.append(node)
-    env.process(transmit(env,node))
+    if confirmed is not None:
+        node.ackTime = airtime(node.packet.sf, 1, ackLength, node.packet.bw)
+        env.process(confirmedTransmit(env,node))
+    elif node.packet.rssi < node.packet.sensitivity:
+        unreachable.append(node)
+    else:
+        env.process(transmit(env,node))
+
+if confirmed is not None:
+    env.process(runTimers(env))
 
 #prepare show
 if (graphics == 1):
@@ -526,11 +1089,92 @@ if (graphics == 1):
     plt.draw()
     plt.show()
 
-# start simulation
-env.run(until=simtime)
+#
+# print the counters of a run, and its DER; the DER lines come after the
+# statistics files
+#
+def printResult(result):
+    print "nrCollisions ", result['collisions']
+    print "energy (in J): ", result['energy']
+    print "sent packets: ", result['sent']
+    print "collisions: ", result['collisions']
+    print "received packets: ", result['received']
+    print "processed packets: ", result['processed']
+    print "lost packets: ", result['lost']
+    if 'deferred' in result:
+        print "deferred packets: ", result['deferred']
+        print "deferral (in ms): ", result['delay']
+        print "dropped packets: ", result['dropped']
+    if 'acked' in result:
+        print "acknowledged packets: ", result['acked']
+        print "failed packets: ", result['failed']
+        print "retransmissions: ", result['retransmissions']
+        print "acks sent: ", result['acks']
+        print "deaf losses: ", result['deaf']
+
+def printDER(result):
+    # data extraction rate
+    der = (result['sent']-result['collisions'])/float(result['sent'])
+    print "DER:", der
+    der = (result['received'])/float(result['sent'])
+    print "DER method 2:", der
+
+# save experiment data into a dat file that can be read by e.g. gnuplot
+# name of file would be:  exp0.dat for experiment 0
+def saveResult(result):
+    fname = "exp-sendtime" + str(experiment) + ".txt"
+    print fname
+    if os.path.isfile(fname):
+        res = "\n" + str(avgSendTime) + "," + str(payloadSize) + "," + str(result['collisions']) + ","  + str(result['sent'])
+    else:
+        res = "%#simTime nrNodes TxPower\n" + str(simtime) + "," + str(nrNodes) + "," + str(Ptx) + ", 0 \n" + "%#SendTime PayloadSize nrCollisions nrTransmissions\n" + str(avgSendTime) + "," + str(payloadSize) + "," + str(result['collisions']) + ","  + str(result['sent'])
+    with open(fname, "a") as myfile:
+        myfile.write(res)
+    myfile.close()
+
+# a run with a seed may be in the result cache, under the key loraRun.py
+# gives a run of the simpy engine
+cacheParams = {
+    'nrNodes': nrNodes,
+    'avgSendTime': avgSendTime,
+    'payloadSize': payloadSize,
+    'experiment': experiment,
+    'simtime': simtime,
+    'full_collision': bool(full_collision),
+    'seed': seed,
+    'scenario': os.path.abspath(opts['scenario']) if 'scenario' in opts else None,
+    'options': tuple(a for a in sys.argv[1:] if a.startswith('--')
+                     and a[2:].split('=', 1)[0] not in ['seed', 'scenario']),
+}
+cacheKey = None if 'nocache' in opts else loraCache.runKey('simpy', cacheParams)
+resultCache = loraCache.resultCache()
+if cacheKey is not None:
+    result = resultCache.get(cacheKey)
+    if result is not None:
+        printResult(result)
+        printDER(result)
+        if 'nosave' not in opts:
+            saveResult(result)
+        exit(0)
 
-# print stats and save into file
-print "nrCollisions ", nrCollisions
+# start simulation
+if 'progress' in opts or 'status' in opts:
+    runWithProgress(env, simtime, float(opts.get('progress') or 1), opts.get('status'))
+else:
+    env.run(until=simtime)
+
+# packets of nodes below sensitivity are all lost
+for node in unreachable:
+    if schedule is None:
+        node.sent, lost, deferred, delay = unreachableSends(
+            node.period, node.packet.rectime, simtime,
+            None if dutyCycle is None else nodeSpacing[node.nodeid])
+        nodeDeferred[node.nodeid] = deferred
+        nodeDelay[node.nodeid] = delay
+    else:
+        node.sent, lost = scheduledSends(schedule[node.nodeid], node.packet.rectime, simtime)
+    nrLost += lost
+    nodeLost[node.nodeid] = lost
 
 # compute energy
 # Transmit consumption in mA from -2 to +17 dBm
@@ -543,34 +1187,65 @@ V = 3.0     # voltage XXX
 sent = sum(n.sent for n in nodes)
 energy = sum(node.packet.rectime * TX[int(node.packet.txpow)+2] * V * node.sent for node in nodes) / 1e6
 
-print "energy (in J): ", energy
-print "sent packets: ", sent
-print "collisions: ", nrCollisions
-print "received packets: ", nrReceived
-print "processed packets: ", nrProcessed
-print "lost packets: ", nrLost
+result = {'energy': energy, 'sent': sent, 'collisions': nrCollisions, 'received': nrReceived,
+          'processed': nrProcessed, 'lost': nrLost}
+if dutyCycle is not None:
+    result.update(deferred=sum(nodeDeferred), delay=sum(nodeDelay), dropped=sum(nodeDropped))
+if confirmed is not None:
+    result.update(acked=nrAcked, failed=nrFailed, retransmissions=nrRetransmissions,
+                  acks=nrAcks, deaf=nrDeaf)
+printResult(result)
+if cacheKey is not None:
+    result['walltime'] = time.time() - startTime
+    resultCache.put(cacheKey, result, dict(cacheParams, engine='simpy'))
 
-# data extraction rate
-der = (sent-nrCollisions)/float(sent)
-print "DER:", der
-der = (nrReceived)/float(sent)
-print "DER method 2:", der
+#
+# per node and per SF statistics, written as columns
+#
+def writeStats(prefix):
+    sf = np.array([n.packet.sf for n in nodes])
+    cols = [
+        ('node', np.arange(nrNodes), '%d'),
+        ('sf', sf, '%d'),
+        ('bw', np.array([n.packet.bw for n in nodes]), '%d'),
+        ('freq', np.array([n.packet.freq for n in nodes]), '%d'),
+        ('rssi', np.array([n.packet.rssi for n in nodes]), '%.2f'),
+        ('sent', np.array([n.sent for n in nodes]), '%d'),
+        ('collided', np.array(nodeCollided), '%d'),
+        ('lost', np.array(nodeLost), '%d'),
+        ('received', np.array(nodeReceived), '%d'),
+        ('processed', np.array(nodeProcessed), '%d'),
+        ('airtime', np.array([n.packet.rectime * n.sent for n in nodes]), '%.3f'),
+        ('energy', np.array([n.packet.rectime * TX[int(n.packet.txpow)+2] * V * n.sent for n in nodes]) / 1e6, '%.6f'),
+    ]
+    if dutyCycle is not None:
+        cols += [('deferred', np.array(nodeDeferred), '%d'), ('delay', np.array(nodeDelay), '%.3f'),
+                 ('dropped', np.array(nodeDropped), '%d')]
+    if confirmed is not None:
+        cols += [('acked', np.array(nodeAcked), '%d'), ('failed', np.array(nodeFailed), '%d'),
+                 ('retransmitted', np.array(nodeRetransmitted), '%d')]
+    np.savetxt(prefix + "-nodes.txt", np.column_stack([c[1] for c in cols]), fmt=[c[2] for c in cols],
+               delimiter=',', header=' '.join(c[0] for c in cols), comments='%#')
+
+    sfs = np.unique(sf)
+    idx = np.searchsorted(sfs, sf)
+    sfcols = [('sf', sfs, '%d'), ('nodes', np.bincount(idx), '%d')]
+    for name, values, fmt in cols[5:]:
+        sfcols.append((name, np.bincount(idx, weights=values, minlength=len(sfs)), fmt.replace('%d', '%.0f')))
+    np.savetxt(prefix + "-sf.txt", np.column_stack([c[1] for c in sfcols]), fmt=[c[2] for c in sfcols],
+               delimiter=',', header=' '.join(c[0] for c in sfcols), comments='%#')
+
+if 'stats' in opts:
+    writeStats(opts['stats'] or "stats")
+
+printDER(result)
 
 # this can be done to keep graphics visible
 if (graphics == 1):
     sys.stdin.read()
 
-# save experiment data into a dat file that can be read by e.g. gnuplot
-# name of file would be:  exp0.dat for experiment 0
-fname = "exp-sendtime" + str(experiment) + ".txt"
-print fname
-if os.path.isfile(fname):
-    res = "\n" + str(avgSendTime) + "," + str(payloadSize) + "," + str(nrCollisions) + ","  + str(sent)
-else:
-    res = "%#simTime nrNodes TxPower\n" + str(simtime) + "," + str(nrNodes) + "," + str(Ptx) + ", 0 \n" + "%#SendTime PayloadSize nrCollisions nrTransmissions\n" + str(avgSendTime) + "," + str(payloadSize) + "," + str(nrCollisions) + ","  + str(sent)
-with open(fname, "a") as myfile:
-    myfile.write(res)
-myfile.close()
+if 'nosave' not in opts:
+    saveResult(result)
 
 # with open('nodes.txt','w') as nfile:
 #     for n in nodes:
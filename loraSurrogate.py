@@ -0,0 +1,225 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Surrogate model of LoRaSim over past runs
+
+ Answers DER, collision rate and energy queries for parameter combinations
+ that were never simulated, from the run table of loraRun.py (and, if given,
+ the expX result files of loraSim.py). Per experiment, collision model,
+ scenario, simulator options and engine class (loraRun.engineClass()) a
+ Gaussian process is fitted on (log nrNodes, log avgSendTime, payloadSize);
+ replications of the same point are averaged and their spread is the noise
+ of that point.
+
+ The DER learned is (sent - collisions)/sent, the first DER loraSim.py
+ prints and the only one the expX files give.
+
+ A query outside the range of the data or with a predictive standard
+ deviation above the tolerance is not covered: then a real simulation is run
+ (and recorded) and added to the runs of the model, so the next query
+ covers it.
+"""
+"""
+ SYNOPSIS:
+   ./loraSurrogate.py <nodes> <avgsend> <payload> <experiment> [collision] [--options]
+ DESCRIPTION:
+    options
+        --runs=file        run table (default runs.txt of loraRun.py)
+        --legacy=file      also use an expX result file of loraSim.py
+        --scenario=file    scenario the runs were made with
+        --simtime=ms       simulated time of the fallback run and energy
+        --tolerance=0.02   largest DER standard deviation answered
+        --nosim            never fall back to a simulation
+        --engine=simpy     engine of loraRun.py whose runs are used and run
+"""
+
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+import loraRun
+
+# length scales never go below these: log nodes, log send time, payload (B)
+minScales = np.array([0.1, 0.1, 2.0])
+
+# learned quantities, all per sent packet or per node and ms
+targets = ['der', 'collisionRate', 'energyRate']
+
+def features(nrNodes, avgSendTime, payloadSize):
+    return np.array([math.log(nrNodes), math.log(avgSendTime), float(payloadSize)])
+
+def groupKey(experiment, full_collision, scenario, options, engine):
+    return (experiment, bool(full_collision), scenario, tuple(loraRun.modelOptions(options)),
+            loraRun.engineClass(engine))
+
+#
+# read an expX file of loraSim.py: a header with simtime and nrNodes and
+# rows of send time, payload, collisions and transmissions. These files
+# were made with the full collision check (see usage.txt) by the model of
+# the simpy engine; they do not tell the packets received.
+#
+def loadLegacy(fname, full_collision=True):
+    experiment = int(re.search(r'(\d+)\.txt$', fname).group(1))
+    runs = []
+    header = None
+    with open(fname) as f:
+        for line in f:
+            if line.startswith('%') or not line.strip():
+                continue
+            values = [float(v) for v in line.split(',') if v.strip()]
+            if header is None:
+                header = values
+                continue
+            sent = int(values[3])
+            runs.append({
+                'nrNodes': int(header[1]), 'avgSendTime': int(values[0]),
+                'payloadSize': int(values[1]), 'experiment': experiment,
+                'simtime': int(header[0]), 'full_collision': full_collision,
+                'sent': sent, 'collisions': int(values[2]),
+                'received': None, 'energy': None,
+                'options': (), 'scenario': None, 'engine': 'simpy',
+            })
+    return runs
+
+#
+# Gaussian process with a squared exponential kernel, constant mean and a
+# noise variance per point
+#
+class gaussianProcess():
+    def __init__(self, X, y, noise):
+        self.X = X
+        self.mean = y.mean()
+        self.scales = np.maximum((X.max(axis=0) - X.min(axis=0))/3.0, minScales)
+        # with few points the prior spread is a tenth of the typical value
+        self.signal = max(y.var(), (0.1*y.mean())**2, 1e-12)
+        K = self.kernel(X, X) + np.diag(noise + 1e-8*self.signal)
+        self.L = np.linalg.cholesky(K)
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, y - self.mean))
+
+    def kernel(self, A, B):
+        d = (A[:, None, :] - B[None, :, :])/self.scales
+        return self.signal*np.exp(-0.5*np.sum(d*d, axis=2))
+
+    def predict(self, x):
+        k = self.kernel(x[None, :], self.X)[0]
+        v = np.linalg.solve(self.L, k)
+        var = max(self.signal - np.dot(v, v), 0.0)
+        return self.mean + np.dot(k, self.alpha), math.sqrt(var)
+
+class surrogate():
+    def __init__(self, runs):
+        self.fit(runs)
+
+    def fit(self, runs):
+        self.runs = list(runs)
+        groups = {}
+        for run in runs:
+            if run['sent'] == 0:
+                continue
+            key = groupKey(run['experiment'], run['full_collision'], run['scenario'], run['options'],
+                           run['engine'])
+            point = (run['nrNodes'], run['avgSendTime'], run['payloadSize'])
+            values = {
+                'der': (run['sent'] - run['collisions'])/float(run['sent']),
+                'collisionRate': run['collisions']/float(run['sent']),
+                'energyRate': None if run['energy'] is None else run['energy']/float(run['nrNodes']*run['simtime']),
+            }
+            groups.setdefault(key, {}).setdefault(point, []).append(values)
+
+        self.models = {}
+        self.bounds = {}
+        for key, points in groups.items():
+            X = np.array([features(*p) for p in sorted(points)])
+            self.bounds[key] = (X.min(axis=0), X.max(axis=0))
+            self.models[key] = {}
+            for t in targets:
+                rows = [(i, [v[t] for v in points[p] if v[t] is not None])
+                        for i, p in enumerate(sorted(points))]
+                rows = [(i, vals) for i, vals in rows if vals]
+                if not rows:
+                    continue
+                idx = np.array([i for i, vals in rows])
+                y = np.array([np.mean(vals) for i, vals in rows])
+                # noise of a mean: sample variance / n, pooled for single runs
+                spread = [np.var(vals, ddof=1) for i, vals in rows if len(vals) > 1]
+                pooled = np.mean(spread) if spread else (0.01*y.mean())**2
+                noise = np.array([(np.var(vals, ddof=1) if len(vals) > 1 else pooled)/len(vals)
+                                  for i, vals in rows])
+                self.models[key][t] = gaussianProcess(X[idx], y, noise)
+
+    #
+    # estimates with standard deviations; 'covered' tells whether the query
+    # lies in the well-covered region
+    #
+    def predict(self, nrNodes, avgSendTime, payloadSize, experiment, simtime,
+                full_collision=False, scenario=None, options=(), tolerance=0.02, engine='simpy'):
+        key = groupKey(experiment, full_collision, scenario, options, engine)
+        answer = {'covered': False}
+        if key not in self.models:
+            return answer
+        x = features(nrNodes, avgSendTime, payloadSize)
+        low, high = self.bounds[key]
+        inside = np.all(x >= low - 1e-9) and np.all(x <= high + 1e-9)
+        for t, model in self.models[key].items():
+            answer[t], answer[t + 'Std'] = model.predict(x)
+        if 'energyRate' in answer:
+            answer['energy'] = answer.pop('energyRate')*nrNodes*simtime
+            answer['energyStd'] = answer.pop('energyRateStd')*nrNodes*simtime
+        answer['covered'] = bool(inside and answer.get('derStd', np.inf) <= tolerance)
+        return answer
+
+#
+# answer from the surrogate when covered, otherwise run (and record) a
+# simulation and refit with it added to the runs of the model
+#
+def query(model, nrNodes, avgSendTime, payloadSize, experiment, simtime,
+          full_collision=False, scenario=None, options=(), tolerance=0.02, simulate=True,
+          engine='simpy'):
+    answer = model.predict(nrNodes, avgSendTime, payloadSize, experiment, simtime,
+                           full_collision, scenario, options, tolerance, engine)
+    answer['source'] = 'surrogate'
+    if answer['covered'] or not simulate:
+        return answer
+    res = loraRun.runSimulation(nrNodes, avgSendTime, payloadSize, experiment, simtime,
+                                full_collision, scenario=scenario, engine=engine, options=options)
+    run = dict(res, nrNodes=nrNodes, avgSendTime=avgSendTime, payloadSize=payloadSize,
+               experiment=experiment, simtime=simtime, full_collision=bool(full_collision),
+               scenario=scenario and os.path.abspath(scenario),
+               options=tuple(loraRun.modelOptions(options)), engine=engine)
+    model.fit(model.runs + [run])
+    return {
+        'source': 'simulation', 'covered': False,
+        'der': (res['sent'] - res['collisions'])/float(res['sent']),
+        'collisionRate': res['collisions']/float(res['sent']),
+        'energy': res['energy'],
+    }
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 5:
+        print "usage: ./loraSurrogate.py nrNodes avgSendTime payloadSize experimentNr [full_collision] [--options]"
+        exit(-1)
+    runs = loraRun.loadRuns(opts.get('runs'))
+    if 'legacy' in opts:
+        runs += loadLegacy(opts['legacy'])
+    start = time.time()
+    model = surrogate(runs)
+    fitted = time.time()
+    scenario = os.path.abspath(opts['scenario']) if 'scenario' in opts else None
+    answer = query(model, int(args[1]), int(args[2]), int(args[3]), int(args[4]),
+                   int(opts.get('simtime', 3600000)),
+                   full_collision=len(args) > 5 and bool(int(args[5])),
+                   scenario=scenario, tolerance=float(opts.get('tolerance', 0.02)),
+                   simulate='nosim' not in opts, engine=opts.get('engine', 'simpy'))
+    print "runs: {}, fit {:.1f} ms, query {:.1f} ms".format(
+        len(runs), 1000*(fitted - start), 1000*(time.time() - fitted))
+    print "source:", answer['source'], "covered:", answer['covered']
+    for t in ['der', 'collisionRate', 'energy']:
+        if t in answer:
+            std = answer.get(t + 'Std')
+            print "{}: {:.4f}".format(t, answer[t]) + ("" if std is None else " +- {:.4f}".format(std))
@@ -0,0 +1,1252 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Sweep engine for LoRaSim
+
+ Instead of running a process per node, the whole arrival process of a run
+ is generated as arrays, the packets are sorted by start time and the
+ collisions are decided in one sweep over them, with the same rules as
+ checkcollision() in loraSim_noprint.py. Node configurations come from
+ scenario bundles (loraScenario.py).
+
+ Several configurations (experiments, payload sizes) can be evaluated on
+ one arrival stream: the exponential waits of every node are drawn once,
+ each configuration adds its own airtimes, and the packets of all of them
+ are swept in a single pass, each configuration with its own receive set
+ and counters. The comparison then uses common random numbers. The other
+ traffic models of loraTraffic.py generate packet times that do not depend
+ on the configuration at all; they are drawn once and shared as well.
+
+ sweepRecord keeps the outcome of every packet of a run and updates it when
+ the settings of a few nodes change, sweeping only the packets that can be
+ affected.
+
+ stream() runs long horizons in windows of simulated time with memory that
+ does not grow with simtime; its arrivals come from a wakeStream.
+
+ With Numba installed the sweep runs compiled (sweepKernel); without it, or
+ with jit=False (--nojit), the plain Python loop does. Both give the same
+ outcomes, compare them with ./loraValidate.py sweep-python sweep.
+"""
+"""
+ SYNOPSIS:
+   ./loraSweep.py <nodes> <avgsend> <payloads> <experiments> <simtime> [collision] [--options]
+ DESCRIPTION:
+    payloads, experiments
+        comma separated lists, every combination is one configuration
+    options
+        --scenario=file   scenario file (default scenarios/ufsm.json)
+        --seed=N          seed of the arrivals and the scenario; a
+                          configuration run with a seed is looked up in
+                          the result cache first (loraCache.py), under
+                          the key of a loraRun.py run of the sweep (with
+                          --window the stream) engine
+        --nocache         do not use the result cache
+        --delta=file      JSON object mapping node numbers to new settings
+                          (sf, bw, cr, txpow, freq, gw), e.g.
+                          {"12": {"txpow": 8}, "40": {"sf": 9}}; the first
+                          configuration is run, changed and updated
+                          incrementally (see sweepRecord)
+        --check           with --delta, run the changed configuration in
+                          full as well and compare
+        --nojit           sweep in Python even if Numba is installed
+        --log=dir         log every packet with the reason it was lost
+                          and the packets it overlapped (see loraLog.py);
+                          with --window written window by window
+        --reps=R          R independent replications in one run (see
+                          replicate()); prints the mean and the 95%
+                          confidence interval of every counter
+        --window=ms       stream the run in windows of ms (see stream());
+                          the results do not depend on the window
+"""
+
+import bisect
+import heapq
+import json
+import math
+import os
+import sys
+import time
+from fractions import Fraction
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+import loraCache
+import loraLog
+import loraScenario
+import loraTraffic
+
+defaultScenario = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios', 'ufsm.json')
+
+# Transmit consumption in mA from -2 to +20 dBm and voltage, as in loraSim.py
+TX = [22, 22, 22, 23,                                      # RFO/PA0: -2..1
+      24, 24, 24, 25, 25, 25, 25, 26, 31, 32, 34, 35, 44,  # PA_BOOST/PA1: 2..14
+      82, 85, 90,                                          # PA_BOOST/PA1: 15..17
+      105, 115, 125]                                       # PA_BOOST/PA1+PA2: 18..20
+V = 3.0
+
+# preamble symbols that may be lost, see timingCollision()
+Npream = 8
+
+# wake-ups per epoch of a wakeStream and window of stream() (ms)
+batch = 1 << 16
+defaultWindow = 3600000
+
+#
+# exponential waits of all nodes, drawn in blocks of (nodes x block) and
+# kept, so every configuration sees the same waits. With several seeds
+# there are nrNodes nodes per seed (a replication each, see replicate()),
+# each group drawing from a generator of its own.
+#
+class arrivalStream():
+    def __init__(self, nrNodes, period, seeds=(None,), block=256):
+        self.nrNodes = nrNodes
+        self.period = float(period)
+        self.block = block
+        self.rngs = [np.random.RandomState(seed) for seed in seeds]
+        self.blocks = []
+
+    # the first k waits of every node (or of the nodes in rows), one row per node
+    def waits(self, k, rows=None):
+        while len(self.blocks)*self.block < k:
+            self.blocks.append(np.vstack([rng.exponential(self.period, (self.nrNodes, self.block))
+                                          for rng in self.rngs]))
+        if rows is None:
+            return np.hstack(self.blocks)[:, :k]
+        return np.hstack([b[rows] for b in self.blocks])[:, :k]
+
+#
+# start times of the packets of every node: a node waits, sends for its
+# airtime and waits again, as transmit() does. With a spacing (airtime/duty
+# cycle per node) a packet starts that long after the previous one at the
+# earliest; then the time added to each wait is returned as well.
+#
+def sendTimes(stream, rectime, simtime, rows=None, spacing=None):
+    k = int(simtime/(stream.period + rectime.min())) + 16
+    while True:
+        cycles = stream.waits(k, rows) + rectime[:, None]
+        if spacing is not None:
+            delay = np.zeros(cycles.shape)
+            delay[:, 1:] = np.maximum(spacing[:, None] - cycles[:, 1:], 0)
+            cycles += delay
+        starts = np.cumsum(cycles, axis=1) - rectime[:, None]
+        if np.all(starts[:, -1] >= simtime):
+            return starts if spacing is None else (starts, delay)
+        k = 2*k
+
+#
+# wake-up times of all nodes for stream(): a Poisson process with mean
+# interval period per node, drawn an epoch at a time from a stream of its
+# own. A node that waits an exponential time after the end of a packet sends
+# at its first wake-up after that end (the wait has no memory), so these are
+# the arrivals of transmit() without a draw per packet. The epochs do not
+# depend on the windows of the caller; an epoch holds about 'batch' wake-ups.
+#
+class wakeStream():
+    def __init__(self, nrNodes, period, seed=None):
+        self.nrNodes = nrNodes
+        self.period = float(period)
+        self.seed = seed
+        self.epoch = batch*self.period/nrNodes
+        self.drawn = 0
+        # wake-ups drawn and not returned yet, by time
+        self.node = np.zeros(0, dtype=np.int64)
+        self.t = np.zeros(0)
+
+    # (node, time) of the wake-ups before until not returned yet, sorted by
+    # node and time
+    def events(self, until):
+        while self.drawn*self.epoch < until:
+            rng = np.random.RandomState(loraTraffic.trafficSeed(self.seed, None, self.drawn))
+            counts = rng.poisson(self.epoch/self.period, self.nrNodes)
+            node = np.repeat(np.arange(self.nrNodes), counts)
+            t = (self.drawn + rng.random_sample(len(node)))*self.epoch
+            order = np.argsort(t, kind='mergesort')
+            self.node = np.r_[self.node, node[order]]
+            self.t = np.r_[self.t, t[order]]
+            self.drawn += 1
+        k = np.searchsorted(self.t, until)
+        node, t = self.node[:k], self.t[:k]
+        self.node, self.t = self.node[k:], self.t[k:]
+        order = np.lexsort((t, node))
+        return node[order], t[order]
+
+#
+# the wake-ups (sorted by node and time) a node sends at: the first one not
+# before free (per node, the end of its last packet) and then the first one
+# after the end of the packet before. A wake-up during a packet that is sent
+# is dropped; then the next one of its node no longer overlaps a sent one,
+# so dropping the first of every overlap settles the rest in a few rounds.
+#
+def renewalStarts(node, t, rectime, free):
+    keep = t >= free[node]
+    while True:
+        idx = np.nonzero(keep)[0]
+        clash = (node[idx[1:]] == node[idx[:-1]]) & (t[idx[1:]] < t[idx[:-1]] + rectime[node[idx[:-1]]])
+        first = clash & ~np.r_[False, clash[:-1]]
+        if not first.any():
+            return keep
+        keep[idx[1:][first]] = False
+
+#
+# packets of a configuration. The random draws are made once, so every
+# configuration, and every change of one (see sweepRecord), sees the same
+# traffic.
+#
+#
+# With reps replications the source has reps times the nodes, node i of
+# replication r is node r*nrNodes + i.
+#
+class trafficSource():
+    def __init__(self, bundle, avgSendTime, simtime, seed=None, reps=1):
+        if bundle['meta'].get('confirmed'):
+            # retransmissions depend on the outcomes, they cannot be drawn ahead
+            raise ValueError("confirmed uplinks need the simpy engine")
+        self.traffic = bundle['meta']['traffic']
+        self.simtime = simtime
+        nrNodes = len(bundle['sf'])
+        # every replication draws from a stream of its own
+        seeds = [loraTraffic.trafficSeed(seed, r if reps > 1 else None) for r in range(reps)]
+        if self.traffic['model'] == 'poisson':
+            self.stream = arrivalStream(nrNodes, avgSendTime, seeds)
+        else:
+            # generation times do not depend on the configuration; a storm
+            # hits the nodes of its own replication only, so every
+            # replication draws its arrays on its own
+            nodes, times = [], []
+            for r in range(reps):
+                rng = np.random.RandomState(seeds[r])
+                node, t = loraTraffic.arrivals(self.traffic, bundle['x'], bundle['y'],
+                                               avgSendTime, simtime, rng)
+                nodes.append(node + r*nrNodes)
+                times.append(t)
+            self.genNode, self.genTime = np.concatenate(nodes), np.concatenate(times)
+
+    #
+    # node and start time of the packets started before simtime, of all
+    # nodes or of the given ones (sorted); rectime of all nodes. Under a
+    # duty cycle limit (spacing and queue as in loraTraffic.dutyCycle()) also
+    # the time the limit added to the wait of each packet and the packets
+    # each node dropped, otherwise None for both.
+    #
+    def packets(self, rectime, nodes=None, spacing=None, queue=None):
+        rows = np.arange(len(rectime)) if nodes is None else nodes
+        if self.traffic['model'] == 'poisson':
+            if spacing is None:
+                starts, delay = sendTimes(self.stream, rectime[rows], self.simtime, nodes), None
+            else:
+                starts, delay = sendTimes(self.stream, rectime[rows], self.simtime, nodes, spacing[rows])
+            node, k = np.nonzero(starts < self.simtime)
+            if delay is None:
+                return rows[node], starts[node, k], None, None
+            return rows[node], starts[node, k], delay[node, k], np.zeros(len(rows), dtype=int)
+        if nodes is None:
+            node, t = self.genNode, self.genTime
+        else:
+            lo = np.searchsorted(self.genNode, nodes)
+            hi = np.searchsorted(self.genNode, nodes, side='right')
+            sel = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)] + [np.zeros(0, dtype=int)])
+            node, t = self.genNode[sel], self.genTime[sel]
+        if spacing is None:
+            starts = loraTraffic.serialize(node, t, rectime)
+            sel = starts < self.simtime
+            return node[sel], starts[sel], None, None
+        keep, starts, delay = loraTraffic.dutyCycle(node, t, rectime, spacing, queue)
+        dropped = np.bincount(node[~keep], minlength=len(rectime))[rows]
+        sel = keep & (starts < self.simtime)
+        return node[sel], starts[sel], delay[sel], dropped
+
+#
+# same as frequencyCollision() in loraSim.py
+#
+def frequencyCollision(f1, bw1, f2):
+    d = abs(f1 - f2)
+    if d <= 120 and bw1 == 500:
+        return True
+    elif d <= 60 and bw1 == 250:
+        return True
+    return d <= 30
+
+#
+# indices that sort key within each block; block is sorted and holds the
+# block numbers 0 .. nrBlocks-1. Sorting every block on its own is cheaper
+# than sorting all of them at once, unless there are many small ones.
+#
+def blockOrder(key, block, nrBlocks):
+    if nrBlocks > 64 and len(key) < 64*nrBlocks:
+        return np.lexsort((key, block))
+    bounds = np.searchsorted(block, np.arange(nrBlocks + 1))
+    order = np.empty(len(key), dtype=np.int64)
+    for b in range(nrBlocks):
+        lo, hi = bounds[b], bounds[b + 1]
+        order[lo:hi] = lo + np.argsort(key[lo:hi], kind='mergesort')
+    return order
+
+#
+# decide collisions of packets sorted by configuration and then by start
+# time; configurations are independent, they are swept one after the
+# other. Every packet belongs to
+# a configuration (cfg) and is heard by one gateway (gw); the rules
+# are those of checkcollision(), including its quirks: with the full check a
+# new packet lost to a same-SF packet in the power domain is not marked (its
+# flag is overwritten by the return value), only the other one is.
+# Returns the collided and processed flags, with causes also the reason
+# (loraLog.py), the culprit (index of the packet it was lost to, the
+# earliest) and the overlap count of every packet, and the overlapping
+# pairs as two arrays (the later packet of each pair and the one it
+# overlapped). jit selects the compiled
+# sweep (default: when there is one). carry holds the collided and processed
+# flags (with causes also the reason, culprit and overlap count) of the
+# first packets, decided in an earlier window (see stream(), one
+# configuration only); they join the receive sets as they are. A carried
+# culprit only tells whether the packet has one, it is kept.
+#
+def sweepCollisions(start, end, cfg, gw, sf, bw, freq, rssi, nrConfigs, nrGateways,
+                    full_collision, maxBSReceives, interf, jit=None, causes=False, carry=None):
+    n = len(start)
+    # every gateway of a configuration has its own load and receive set;
+    # packets on channels more than 120 Hz apart never interfere, so each
+    # channel gets its own set as well
+    station = cfg*nrGateways + gw
+    chans = np.unique(freq)
+    if len(chans) > 1 and np.diff(chans).min() <= 120:
+        group = station
+        nrGroups = nrConfigs*nrGateways
+    else:
+        group = station*len(chans) + np.searchsorted(chans, freq)
+        nrGroups = nrConfigs*nrGateways*len(chans)
+    carry = [np.asarray(a, dtype=dtype) for a, dtype in
+             zip(list(carry or []) + [[]]*5, [np.int8, np.int8, np.int8, np.int64, np.int32])]
+    if jit is None:
+        jit = sweepKernel is not None
+    if jit:
+        res = sweepKernel(np.asarray(start, dtype=float), np.asarray(end, dtype=float),
+                          blockOrder(end, cfg, nrConfigs), np.asarray(cfg, dtype=np.int64),
+                          group.astype(np.int64),
+                          station.astype(np.int64), np.asarray(sf, dtype=np.int64),
+                          np.asarray(bw, dtype=np.int64), np.asarray(freq, dtype=np.int64),
+                          np.asarray(rssi, dtype=float), (2.0**np.asarray(sf))/bw*(Npream - 5),
+                          nrGroups, nrConfigs*nrGateways, bool(full_collision), maxBSReceives,
+                          np.asarray(interf, dtype=float), bool(causes), *carry)
+        return res if causes else res[:2]
+    cfg = cfg.tolist()
+    group = group.tolist()
+    station = station.tolist()
+    start = start.tolist()
+    end = end.tolist()
+    sf = sf.tolist()
+    bw = bw.tolist()
+    freq = freq.tolist()
+    rssi = rssi.tolist()
+    interf = np.asarray(interf).tolist()
+    # end of the part of the preamble that may not be overlapped
+    Tpreamb = [2**s/(1.0*b) * (Npream - 5) for s, b in zip(sf, bw)]
+
+    carried = len(carry[0])
+    collided = carry[0].tolist() + [0]*(n - carried)
+    processed = carry[1].tolist() + [0]*(n - carried)
+    if causes:
+        reason = carry[2].tolist() + [0]*(n - carried)
+        culprit = carry[3].tolist() + [-1]*(n - carried)
+        overlaps = carry[4].tolist() + [0]*(n - carried)
+        pairNew, pairOld = [], []
+    active = [set() for g in range(nrGroups)]
+    processing = [0]*(nrConfigs*nrGateways)
+    ending = []
+    for i in range(carried):
+        active[group[i]].add(i)
+        heapq.heappush(ending, (end[i], i))
+        if processed[i]:
+            processing[station[i]] += 1
+    for i in range(carried, n):
+        now = start[i]
+        # packets that ended leave the gateway, all of them when the next
+        # configuration starts
+        while ending and (ending[0][0] <= now or cfg[ending[0][1]] != cfg[i]):
+            j = heapq.heappop(ending)[1]
+            active[group[j]].discard(j)
+            if processed[j]:
+                processing[station[j]] -= 1
+        c = station[i]
+        if processing[c] > maxBSReceives:
+            processed[i] = 0
+        else:
+            processed[i] = 1
+            processing[c] += 1
+
+        col = 0
+        p1sf = sf[i]
+        p1cs = now + Tpreamb[i]
+        for j in active[group[i]]:
+            if not frequencyCollision(freq[i], bw[i], freq[j]):
+                continue
+            if causes:
+                overlaps[i] += 1
+                overlaps[j] += 1
+                pairNew.append(i)
+                pairOld.append(j)
+            if p1sf == sf[j]:
+                if full_collision:
+                    if p1cs < end[j] and rssi[i] - rssi[j] > -6:
+                        collided[j] = 1
+                        if causes and culprit[j] < 0:
+                            reason[j], culprit[j] = loraLog.CAPTURE, i
+                else:
+                    collided[j] = 1
+                    col = 1
+                    if causes:
+                        if culprit[j] < 0:
+                            reason[j], culprit[j] = loraLog.COLLISION, i
+                        if culprit[i] < 0 or j < culprit[i]:
+                            reason[i], culprit[i] = loraLog.COLLISION, j
+            elif p1cs < end[j] and rssi[i] - rssi[j] < -interf[p1sf-7][sf[j]-6]:
+                col = 1
+                if causes and (culprit[i] < 0 or j < culprit[i]):
+                    reason[i], culprit[i] = loraLog.REJECTION, j
+        collided[i] = col
+        active[group[i]].add(i)
+        heapq.heappush(ending, (end[i], i))
+    res = np.array(collided, dtype=np.int8), np.array(processed, dtype=np.int8)
+    if causes:
+        res += np.array(reason, dtype=np.int8), np.array(culprit), np.array(overlaps, dtype=np.int32)
+        res += np.array(pairNew, dtype=np.int64), np.array(pairOld, dtype=np.int64)
+    return res
+
+#
+# the same sweep as loops over arrays, compiled when Numba is installed.
+# The active packets of a group are a linked list (nxt, prv); they leave in
+# the order of their end times per configuration (endOrder): a packet that
+# ended before the current one started before it, so a pointer into that
+# order replaces the heap. Carried packets only join the lists.
+#
+def sweepLoops(start, end, endOrder, cfg, group, station, sf, bw, freq, rssi, Tpreamb,
+               nrGroups, nrStations, full_collision, maxBSReceives, interf, causes,
+               carryCollided, carryProcessed, carryReason, carryCulprit, carryOverlaps):
+    n = len(start)
+    carried = len(carryCollided)
+    collided = np.zeros(n, dtype=np.int8)
+    processed = np.zeros(n, dtype=np.int8)
+    m = n if causes else 0
+    reason = np.zeros(m, dtype=np.int8)
+    culprit = np.zeros(m, dtype=np.int64) - 1
+    overlaps = np.zeros(m, dtype=np.int32)
+    # overlapping pairs, in arrays that double when full
+    pairNew = np.zeros(1024 if causes else 0, dtype=np.int64)
+    pairOld = np.zeros(1024 if causes else 0, dtype=np.int64)
+    pairs = 0
+    head = np.zeros(nrGroups, dtype=np.int64) - 1
+    nxt = np.zeros(n, dtype=np.int64) - 1
+    prv = np.zeros(n, dtype=np.int64) - 1
+    processing = np.zeros(nrStations, dtype=np.int64)
+    rows = interf.shape[0]
+    for i in range(carried):
+        collided[i] = carryCollided[i]
+        processed[i] = carryProcessed[i]
+        if causes:
+            reason[i] = carryReason[i]
+            culprit[i] = carryCulprit[i]
+            overlaps[i] = carryOverlaps[i]
+        if processed[i] == 1:
+            processing[station[i]] += 1
+        g = group[i]
+        nxt[i] = head[g]
+        if head[g] >= 0:
+            prv[head[g]] = i
+        head[g] = i
+    p = 0
+    for i in range(carried, n):
+        now = start[i]
+        # packets that ended leave the gateway, all of them when the next
+        # configuration starts
+        while p < n and (cfg[endOrder[p]] < cfg[i] or end[endOrder[p]] <= now):
+            j = endOrder[p]
+            p += 1
+            if prv[j] >= 0:
+                nxt[prv[j]] = nxt[j]
+            else:
+                head[group[j]] = nxt[j]
+            if nxt[j] >= 0:
+                prv[nxt[j]] = prv[j]
+            if processed[j] == 1:
+                processing[station[j]] -= 1
+        c = station[i]
+        if processing[c] > maxBSReceives:
+            processed[i] = 0
+        else:
+            processed[i] = 1
+            processing[c] += 1
+
+        col = 0
+        row = sf[i] - 7
+        if row < 0:
+            # SF6 gets the last row, as in loraSim.py
+            row += rows
+        p1cs = now + Tpreamb[i]
+        j = head[group[i]]
+        while j >= 0:
+            d = abs(freq[i] - freq[j])
+            if d <= 30 or (d <= 60 and bw[i] == 250) or (d <= 120 and bw[i] == 500):
+                if causes:
+                    overlaps[i] += 1
+                    overlaps[j] += 1
+                    if pairs == len(pairNew):
+                        grown = np.zeros(2*pairs, dtype=np.int64)
+                        grown[:pairs] = pairNew
+                        pairNew = grown
+                        grown = np.zeros(2*pairs, dtype=np.int64)
+                        grown[:pairs] = pairOld
+                        pairOld = grown
+                    pairNew[pairs] = i
+                    pairOld[pairs] = j
+                    pairs += 1
+                if sf[i] == sf[j]:
+                    if full_collision:
+                        if p1cs < end[j] and rssi[i] - rssi[j] > -6:
+                            collided[j] = 1
+                            if causes and culprit[j] < 0:
+                                reason[j] = CAPTURE
+                                culprit[j] = i
+                    else:
+                        collided[j] = 1
+                        col = 1
+                        if causes:
+                            if culprit[j] < 0:
+                                reason[j] = COLLISION
+                                culprit[j] = i
+                            if culprit[i] < 0 or j < culprit[i]:
+                                reason[i] = COLLISION
+                                culprit[i] = j
+                elif p1cs < end[j] and rssi[i] - rssi[j] < -interf[row, sf[j] - 6]:
+                    col = 1
+                    if causes and (culprit[i] < 0 or j < culprit[i]):
+                        reason[i] = REJECTION
+                        culprit[i] = j
+            j = nxt[j]
+        collided[i] = col
+        g = group[i]
+        nxt[i] = head[g]
+        prv[i] = -1
+        if head[g] >= 0:
+            prv[head[g]] = i
+        head[g] = i
+    return collided, processed, reason, culprit, overlaps, pairNew[:pairs], pairOld[:pairs]
+
+# reason codes as constants of the compiled code
+COLLISION, CAPTURE, REJECTION = loraLog.COLLISION, loraLog.CAPTURE, loraLog.REJECTION
+
+sweepKernel = numba.njit(cache=True)(sweepLoops) if numba is not None else None
+
+#
+# run all bundles (same node count) on one arrival stream, returns a dict of
+# counters per bundle like loraSim_noprint.py prints them. With a
+# loraLog.packetLog every packet is logged as well.
+#
+def simulate(bundles, avgSendTime, simtime, full_collision=False, seed=None, jit=None,
+             log=None):
+    return [res[0] for res in replicate(bundles, avgSendTime, simtime, 1, full_collision,
+                                        seed, jit, log)]
+
+#
+# reps independent replications of the bundles in one run, returns the
+# counters per bundle and replication. The replications are one more batch
+# dimension: the traffic source draws the packets of all of them at once,
+# the node configuration is shared (indexed, not rebuilt) and the packets
+# are swept in one pass with receive sets and counters per bundle and
+# replication (cfg = bundle*reps + replication, in the log as well). With
+# reps > 1 the draws differ from those of simulate() with the same seed.
+#
+def replicate(bundles, avgSendTime, simtime, reps, full_collision=False, seed=None, jit=None,
+              log=None):
+    nrNodes = len(bundles[0]['sf'])
+    meta = bundles[0]['meta']
+    source = trafficSource(bundles[0], avgSendTime, simtime, seed, reps)
+
+    packets = []
+    for c, b in enumerate(bundles):
+        tiled = dict((k, np.tile(np.asarray(b[k]), reps)) for k in ['rectime', 'freq'])
+        node, starts, delay, dropped = source.packets(tiled['rectime'].astype(float), None,
+                                                      *dutyLimits(tiled, b['meta']))
+        packets.append(((c*reps + node//nrNodes).astype(np.int32), node % nrNodes, starts, delay,
+                        dropped))
+    cfg = np.concatenate([p[0] for p in packets])
+    node = np.concatenate([p[1] for p in packets])
+    start = np.concatenate([p[2] for p in packets])
+
+    # per packet configuration
+    def column(name):
+        return np.concatenate([np.asarray(b[name])[p[1]] for b, p in zip(bundles, packets)])
+    rectime = column('rectime')
+    end = start + rectime
+    reach = column('rssi') >= column('sensitivity')
+
+    # packets of nodes below sensitivity never reach the gateway; the
+    # sources give the packets by node, so cfg is sorted
+    idx = np.nonzero(reach)[0]
+    idx = idx[blockOrder(start[idx], cfg[idx], len(bundles)*reps)]
+    collided = np.zeros(len(start), dtype=np.int8)
+    processed = np.zeros(len(start), dtype=np.int8)
+    res = sweepCollisions(
+        start[idx], end[idx], cfg[idx], column('gw')[idx], column('sf')[idx], column('bw')[idx],
+        column('freq')[idx], column('rssi')[idx], len(bundles)*reps, len(meta['gateways']),
+        full_collision, meta['radio']['maxBSReceives'], meta['rejection'], jit, log is not None)
+    collided[idx], processed[idx] = res[:2]
+    if log is not None:
+        logPackets(log, column, cfg, node, start, end, reach, processed, idx, res[2:], simtime)
+
+    # the packets of each bundle and replication
+    bounds = np.searchsorted(cfg, np.arange(len(bundles)*reps + 1))
+    delay = None if packets[0][3] is None else np.concatenate([p[3] for p in packets])
+    results = []
+    for c, (b, p) in enumerate(zip(bundles, packets)):
+        results.append([])
+        for r in range(reps):
+            mine = slice(bounds[c*reps + r], bounds[c*reps + r + 1])
+            results[c].append(countPackets(
+                node[mine], end[mine], reach[mine], collided[mine], processed[mine],
+                b['rectime'], b['txpow'], simtime, None if delay is None else delay[mine],
+                None if p[4] is None else p[4][r*nrNodes:(r + 1)*nrNodes]))
+    return results
+
+#
+# t with P(|T| < t) = level for Student's t with df (an integer) degrees of
+# freedom, bisected on the closed form of P(|T| < t) (Abramowitz and
+# Stegun 26.7.3 and 26.7.4)
+#
+def tQuantile(level, df):
+    def inside(t):
+        theta = math.atan(t/math.sqrt(df))
+        c2 = math.cos(theta)**2
+        term = total = 1.0
+        if df % 2 == 0:
+            for k in range(1, df//2):
+                term *= (2*k - 1)/(2.0*k)*c2
+                total += term
+            return math.sin(theta)*total
+        if df == 1:
+            return 2*theta/math.pi
+        for k in range(1, (df - 1)//2):
+            term *= 2.0*k/(2*k + 1)*c2
+            total += term
+        return 2/math.pi*(theta + math.sin(theta)*math.cos(theta)*total)
+    lo, hi = 0.0, 1.0
+    while inside(hi) < level:
+        lo, hi = hi, 2*hi
+    while hi - lo > 1e-12*hi:
+        mid = (lo + hi)/2
+        if inside(mid) < level:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi)/2
+
+#
+# mean and half width of the confidence interval (Student's t with R-1
+# degrees of freedom for R replications) of the counters and the DER over
+# replications
+#
+def replicationSummary(results, level=0.95):
+    values = dict((key, [res[key] for res in results]) for key in results[0])
+    values['DER'] = [res['received']/float(res['sent']) if res['sent'] else 0.0 for res in results]
+    n = len(results)
+    t = tQuantile(level, n - 1) if n > 1 else float('nan')
+    summary = {}
+    for key, v in values.items():
+        v = np.asarray(v, dtype=float)
+        half = t*np.std(v, ddof=1)/np.sqrt(n) if n > 1 else float('nan')
+        summary[key] = (np.mean(v), half)
+    return summary
+
+#
+# one bundle run in windows of 'window' ms, the packets drawn by a wakeStream.
+# A window holds the packets starting in it and the packets still on air
+# from the windows before (carried with their flags, see sweepCollisions());
+# a packet that ended within the window is final and goes into the counters.
+# Memory grows with the packets of a window, not with simtime, and the
+# counters do not depend on the window. The arrivals are those of
+# transmit() but not the draws of simulate(): results agree with it in
+# distribution only. Only the poisson traffic model without duty cycle
+# limits or confirmed uplinks is supported.
+#
+# With a loraLog.packetLog every packet is logged, as configuration cfg,
+# after the rows already in the log. A packet gets its row (its place in
+# start order) when it starts and is written there once it is final, with
+# the rows it overlapped, so the log costs memory for a window as well.
+#
+def stream(bundle, avgSendTime, simtime, window=None, full_collision=False, seed=None, jit=None,
+           log=None, cfg=0):
+    meta = bundle['meta']
+    if meta['traffic']['model'] != 'poisson':
+        raise ValueError("streaming does not support the {} traffic model".format(
+            meta['traffic']['model']))
+    if meta.get('dutyCycle'):
+        raise ValueError("streaming does not support duty cycle limits")
+    if meta.get('confirmed'):
+        raise ValueError("confirmed uplinks need the simpy engine")
+    window = float(window or defaultWindow)
+    conf = dict((k, np.asarray(bundle[k])) for k in ['gw', 'sf', 'bw', 'freq', 'rssi'])
+    rectime = np.asarray(bundle['rectime'], dtype=float)
+    reach = np.asarray(bundle['rssi']) >= np.asarray(bundle['sensitivity'])
+    nrNodes = len(rectime)
+    wakes = wakeStream(nrNodes, avgSendTime, seed)
+
+    res = {'collisions': 0, 'received': 0, 'processed': 0, 'lost': 0}
+    sent = np.zeros(nrNodes, dtype=np.int64)
+    # end of the last packet of every node
+    free = np.zeros(nrNodes)
+    # node, start, row and outcome (flags, with a log also reason, culprit
+    # row and overlaps) of the packets on air at the start of the window
+    carry = [np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64),
+             np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8)]
+    if log is not None:
+        carry += [np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)]
+    # the rows the packets still on air overlapped so far, as links
+    # (owner, other)
+    links = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    rows = 0 if log is None else log.count
+    w0 = 0.0
+    while w0 < simtime:
+        w1 = min(w0 + window, simtime)
+        node, t = wakes.events(w1)
+        keep = renewalStarts(node, t, rectime, free)
+        node, t = node[keep], t[keep]
+        last = np.r_[node[1:] != node[:-1], True] if len(node) else np.zeros(0, dtype=bool)
+        free[node[last]] = t[last] + rectime[node[last]]
+        sent += np.bincount(node, minlength=nrNodes)
+
+        # equal start times in node order, as in simulate()
+        order = np.argsort(t, kind='mergesort')
+        node, t = node[order], t[order]
+        row = rows + np.arange(len(node))
+        rows += len(node)
+        lost = ~reach[node]
+        end = t + rectime[node]
+        res['lost'] += int(np.sum(lost & (end < simtime)))
+        if log is not None:
+            why = np.where(end[lost] < simtime, loraLog.SENSITIVITY, loraLog.UNFINISHED)
+            logStream(log, conf, cfg, node[lost], t[lost], end[lost], row[lost],
+                      np.zeros(np.sum(lost), dtype=np.int8), why,
+                      np.zeros(np.sum(lost), dtype=np.int64) - 1, np.zeros(np.sum(lost), dtype=np.int32),
+                      np.zeros(0, dtype=np.int64))
+
+        node = np.r_[carry[0], node[~lost]]
+        start = np.r_[carry[1], t[~lost]]
+        row = np.r_[carry[2], row[~lost]]
+        end = start + rectime[node]
+        out = sweepCollisions(
+            start, end, np.zeros(len(node), dtype=np.int32), conf['gw'][node], conf['sf'][node],
+            conf['bw'][node], conf['freq'][node], conf['rssi'][node], 1, len(meta['gateways']),
+            full_collision, meta['radio']['maxBSReceives'], meta['rejection'], jit,
+            log is not None, carry[3:])
+        final = end <= w1
+        done = final & (end < simtime)
+        collided, processed = out[:2]
+        res['collisions'] += int(np.sum(done & (collided == 1)))
+        res['received'] += int(np.sum(done & (collided == 0)))
+        res['processed'] += int(np.sum(done & (processed == 1)))
+        out = list(out)
+        if log is not None:
+            # culprits as rows; a carried packet that had one keeps its row
+            culprit = out[3]
+            fresh = culprit >= 0
+            fresh[:len(carry[0])] &= carry[6] < 0
+            out[3] = np.where(fresh, row[np.where(fresh, culprit, 0)], culprit)
+            why = np.where(end < simtime, out[2], loraLog.UNFINISHED)
+            # a final packet overlaps no later one, its links are complete
+            a, b = row[out[5]], row[out[6]]
+            owner, other = np.r_[links[0], a, b], np.r_[links[1], b, a]
+            closed = np.in1d(owner, row[final])
+            logStream(log, conf, cfg, node[final], start[final], end[final], row[final],
+                      processed[final], why[final], out[3][final], out[4][final],
+                      overlapTable(owner[closed], other[closed], 0)[0])
+            links = owner[~closed], other[~closed]
+        carry = [a[~final] for a in [node, start, row] + out[:5]]
+        w0 = w1
+    if log is not None:
+        # still on air at the end of the run
+        node, start, row = carry[:3]
+        logStream(log, conf, cfg, node, start, start + rectime[node], row, carry[4],
+                  np.zeros(len(node), dtype=np.int8) + loraLog.UNFINISHED, carry[6], carry[7],
+                  overlapTable(links[0], links[1], 0)[0])
+    current = np.array(TX)[np.asarray(bundle['txpow']).astype(int) + 2]
+    res['sent'] = int(np.sum(sent))
+    res['energy'] = float(np.sum(rectime*current*V*sent)/1e6)
+    return res
+
+# write packets of stream() to the log at their rows (ascending), with the
+# rows they overlapped, row after row
+def logStream(log, conf, cfg, node, start, end, row, processed, reason, culprit, overlaps, other):
+    rows = {'cfg': np.zeros(len(node), dtype=np.int32) + cfg, 'node': node, 'start': start,
+            'end': end, 'processed': processed, 'reason': reason, 'culprit': culprit,
+            'overlaps': overlaps}
+    for name in ['sf', 'bw', 'freq', 'rssi', 'gw']:
+        rows[name] = conf[name][node]
+    log.write(row, rows, other)
+
+#
+# spacing and queue of the nodes of a configuration for
+# trafficSource.packets(), None if the scenario has no duty cycle limit
+#
+def dutyLimits(conf, meta):
+    if not meta.get('dutyCycle'):
+        return None, None
+    spacing = np.asarray(conf['rectime'], dtype=float)/loraScenario.dutyCycles(meta, conf['freq'])
+    return spacing, meta['dutyCycle'].get('queue', 1)
+
+#
+# overlap table of rows from the links (owner, other), a row the owner
+# overlapped each: the others, row after row and ascending within a row,
+# and where the first n rows start among them
+#
+def overlapTable(owner, other, n):
+    if len(owner) == 0:
+        return other, np.zeros(n + 1, dtype=np.int64)
+    # links are unique, one key sorts them (cheaper than a lexsort)
+    size = int(max(owner.max(), other.max())) + 1
+    order = np.argsort(owner*size + other)
+    return other[order], np.searchsorted(owner[order], np.arange(n + 1))
+
+#
+# append the packets to a log in order of start time. idx are the swept
+# packets, causes their reasons, culprits (indices into idx), overlaps and
+# overlapping pairs (indices into idx).
+#
+def logPackets(log, column, cfg, node, start, end, reach, processed, idx, causes, simtime):
+    reason, culprit, overlaps, pairNew, pairOld = causes
+    order = np.argsort(start, kind='mergesort')
+    row = np.empty(len(order), dtype=np.int64)
+    row[order] = np.arange(len(order))
+    why = np.where(reach, loraLog.RECEIVED, loraLog.SENSITIVITY).astype(np.int8)
+    why[idx] = reason
+    why[end >= simtime] = loraLog.UNFINISHED
+    lostTo = np.zeros(len(order), dtype=np.int64) - 1
+    lostTo[idx] = np.where(culprit >= 0, row[idx[culprit]], -1)
+    seen = np.zeros(len(order), dtype=np.int32)
+    seen[idx] = overlaps
+    a, b = row[idx[pairNew]], row[idx[pairOld]]
+    other, bounds = overlapTable(np.r_[a, b], np.r_[b, a], len(order))
+    del a, b
+    del row
+    rows = {'cfg': cfg, 'node': node, 'start': start, 'end': end, 'processed': processed,
+            'reason': why, 'culprit': lostTo, 'overlaps': seen}
+    for name in ['sf', 'bw', 'freq', 'rssi', 'gw']:
+        rows[name] = column(name)
+    for k in range(0, len(order), log.chunk):
+        sel = order[k:k + log.chunk]
+        log.append(dict((name, a[sel]) for name, a in rows.items()),
+                   other[bounds[k]:bounds[k + len(sel)]])
+
+#
+# counters of the packets of one configuration; like transmit(), a packet
+# counts once its airtime is over. With a duty cycle limit also the packets
+# deferred and dropped by it and the total deferral (ms).
+#
+def countPackets(node, end, reach, collided, processed, rectime, txpow, simtime,
+                 delay=None, dropped=None):
+    done = end < simtime
+    sent = np.bincount(node, minlength=len(rectime))
+    current = np.array(TX)[np.asarray(txpow).astype(int) + 2]
+    res = {
+        'sent': len(node),
+        'collisions': int(np.sum(done & reach & (collided == 1))),
+        'received': int(np.sum(done & reach & (collided == 0))),
+        'processed': int(np.sum(done & reach & (processed == 1))),
+        'lost': int(np.sum(done & ~reach)),
+        'energy': float(np.sum(np.asarray(rectime)*current*V*sent)/1e6),
+    }
+    if delay is not None:
+        res['deferred'] = int(np.sum(delay > 0))
+        # summed exactly (then rounded), so the total does not depend on the
+        # packet order
+        res['delay'] = math.fsum(np.asarray(delay).tolist())
+        res['dropped'] = int(np.sum(dropped))
+    return res
+
+#
+# outcome record of one configuration that follows changes of the radio
+# settings of a few nodes. The packets of a gateway fall into busy periods
+# (maximal runs of overlapping packets); between two of them no packet is on
+# air and the receive count is zero, so the outcomes of a busy period depend
+# on its packets only. The record keeps, per gateway, the busy periods as
+# blocks sorted by time (los, his: start and end of every block) with their
+# packets and counters. A change takes the packets of the changed nodes out
+# of their blocks, merges the blocks their new packets overlap and sweeps
+# only the blocks it touched, which are split into busy periods again; the
+# totals follow the counters of the blocks. The cost grows with the packets
+# of the touched blocks and the number of nodes, not with the run. Near
+# saturation busy periods get long and a change touches much of the run.
+#
+# Packets live in arrays that only grow: the packets of a changed node get
+# new slots, their old ones are no longer in any block.
+#
+class sweepRecord():
+    # settings a change may give, the rest follows from them
+    fields = ['sf', 'bw', 'cr', 'txpow', 'freq', 'gw']
+
+    def __init__(self, bundle, avgSendTime, simtime, full_collision=False, seed=None, jit=None):
+        self.meta = bundle['meta']
+        self.simtime = simtime
+        self.full_collision = full_collision
+        self.jit = jit
+        self.conf = dict((k, np.array(bundle[k])) for k in loraScenario.nodeFields)
+        self.source = trafficSource(bundle, avgSendTime, simtime, seed)
+        nrNodes = len(self.conf['rectime'])
+        self.size = 0
+        self.node = np.zeros(0, dtype=np.int64)
+        self.start = np.zeros(0)
+        self.delay = None
+        self.collided = np.zeros(0, dtype=np.int8)
+        self.processed = np.zeros(0, dtype=np.int8)
+        # slots of the packets of every node, packets and packets done per node
+        self.slots = [np.zeros(0, dtype=np.int64)]*nrNodes
+        self.sent = np.zeros(nrNodes, dtype=np.int64)
+        self.done = np.zeros(nrNodes, dtype=np.int64)
+        # sums over the blocks and over the packets (deferral exactly, so it
+        # does not depend on the order of the changes)
+        self.totals = np.zeros(3, dtype=np.int64)
+        self.deferred = 0
+        self.delayTotal = Fraction(0)
+        self.swept = 0
+
+        node, start, delay, self.dropped = self.source.packets(
+            self.conf['rectime'], None, *dutyLimits(self.conf, self.meta))
+        slots = self.add(node, start, delay)
+        for n, s in zip(*self.byNode(node, slots)):
+            self.slots[n] = s
+
+        # one sweep over all packets, a gateway at a time, then the blocks
+        # of every gateway
+        nrGateways = len(self.meta['gateways'])
+        idx = slots[self.reach()[node]]
+        gw = self.conf['gw'][self.node[idx]]
+        order = np.lexsort((self.node[idx], self.start[idx], gw))
+        idx, gw = idx[order], gw[order]
+        self.collided[idx], self.processed[idx] = self.decide(idx, gw, nrGateways)
+        self.swept = len(idx)
+        los, his, heads, blocks = self.periods(idx, gw)
+        bounds = np.searchsorted(heads, np.arange(nrGateways + 1)).tolist()
+        self.los = [los[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        self.his = [his[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        self.blocks = [blocks[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def reach(self):
+        return self.conf['rssi'] >= self.conf['sensitivity']
+
+    def end(self, idx):
+        return self.start[idx] + self.conf['rectime'][self.node[idx]]
+
+    # store packets in new slots, returns the slots
+    def add(self, node, start, delay):
+        n = len(node)
+        if self.size + n > len(self.node):
+            room = max(2*len(self.node), self.size + n)
+            self.node = np.resize(self.node, room)
+            self.start = np.resize(self.start, room)
+            self.collided = np.resize(self.collided, room)
+            self.processed = np.resize(self.processed, room)
+            if delay is not None:
+                self.delay = np.resize(self.delay if self.delay is not None else np.zeros(0), room)
+        slots = np.arange(self.size, self.size + n)
+        self.node[slots] = node
+        self.start[slots] = start
+        self.collided[slots] = 0
+        self.processed[slots] = 0
+        if delay is not None:
+            self.delay[slots] = delay
+        self.size += n
+        self.count(slots, 1)
+        return slots
+
+    # add (sign 1) or take out (-1) the packets in the slots from the sums
+    def count(self, slots, sign):
+        node = self.node[slots]
+        np.add.at(self.sent, node, sign)
+        np.add.at(self.done, node[self.end(slots) < self.simtime], sign)
+        if self.delay is not None:
+            delay = self.delay[slots]
+            self.deferred += sign*int(np.sum(delay > 0))
+            self.delayTotal += sign*sum((Fraction(d) for d in delay.tolist()), Fraction(0))
+
+    # nodes and their slots, slots sorted by node
+    def byNode(self, node, slots):
+        bounds = np.r_[0, np.nonzero(np.diff(node))[0] + 1, len(node)]
+        nodes = node[bounds[:-1]] if len(node) else node
+        return nodes.tolist(), [slots[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    #
+    # outcomes of the packets idx, sorted by segment (packets of different
+    # segments are independent), start and node; the segments are swept as
+    # configurations of their own
+    #
+    def decide(self, idx, seg, nrSegs):
+        c = self.conf
+        n = self.node[idx]
+        return sweepCollisions(
+            self.start[idx], self.end(idx), seg.astype(np.int32), c['gw'][n], c['sf'][n],
+            c['bw'][n], c['freq'][n], c['rssi'][n], nrSegs, len(self.meta['gateways']),
+            self.full_collision, self.meta['radio']['maxBSReceives'], self.meta['rejection'],
+            self.jit)
+
+    #
+    # busy periods of the swept packets idx, sorted as for decide(): their
+    # starts, ends, segments and blocks [slots, counters, start]. The
+    # counters are added to the totals.
+    #
+    def periods(self, idx, seg):
+        if len(idx) == 0:
+            return [], [], np.zeros(0, dtype=np.int64), []
+        end = self.end(idx)
+        # start and end compared by rank, lifted by segment: the running
+        # maximum then restarts with every segment and stays exact
+        values, rank = np.unique(np.r_[self.start[idx], end], return_inverse=True)
+        rank = rank + np.tile(seg.astype(np.int64)*len(values), 2)
+        first = np.r_[True, rank[1:len(idx)] >= np.maximum.accumulate(rank[len(idx):])[:-1]]
+        heads = np.nonzero(first)[0]
+        done = end < self.simtime
+        flags = np.array([done & (self.collided[idx] == 1), done & (self.collided[idx] == 0),
+                          done & (self.processed[idx] == 1)], dtype=np.int64)
+        counts = np.add.reduceat(flags, heads, axis=1).T
+        self.totals += counts.sum(axis=0)
+        los = self.start[idx][heads].tolist()
+        blocks = [[slots, c, lo] for slots, c, lo in zip(np.split(idx, heads[1:]), counts, los)]
+        return los, np.maximum.reduceat(end, heads).tolist(), seg[heads], blocks
+
+    # index of the block of gateway gw holding a packet that starts at t
+    def blockAt(self, gw, t):
+        return bisect.bisect_right(self.los[gw], t) - 1
+
+    #
+    # change the settings of some nodes, delta maps a node to a dict of new
+    # settings. Returns the counters of the changed configuration.
+    #
+    def change(self, delta):
+        self.swept = 0
+        nodes = np.array(sorted(int(n) for n in delta), dtype=int)
+        # blocks to sweep again, by gateway and identity
+        dirty = {}
+
+        # the old packets leave their blocks
+        for n in nodes.tolist():
+            slots = self.slots[n]
+            self.count(slots, -1)
+            if not self.reach()[n] or len(slots) == 0:
+                continue
+            gw = self.conf['gw'][n]
+            for i in sorted(set(self.blockAt(gw, t) for t in self.start[slots].tolist())):
+                block = self.blocks[gw][i]
+                block[0] = block[0][self.node[block[0]] != n]
+                dirty[id(block)] = (gw, block)
+
+        for n in nodes.tolist():
+            self.configure(n, delta.get(n, delta.get(str(n))))
+
+        # the new packets join the blocks they overlap
+        node, start, delay, dropped = self.source.packets(
+            self.conf['rectime'], nodes, *dutyLimits(self.conf, self.meta))
+        slots = self.add(node, start, delay)
+        if dropped is not None:
+            self.dropped[nodes] = dropped
+        mine = dict(zip(*self.byNode(node, slots)))
+        reach = self.reach()
+        for n in nodes.tolist():
+            self.slots[n] = mine.get(n, np.zeros(0, dtype=np.int64))
+            if reach[n]:
+                self.insert(self.conf['gw'][n], self.slots[n], dirty)
+
+        self.resweep(dirty.values())
+        return self.result()
+
+    # put the packets in the slots into the blocks of gateway gw, merging
+    # the blocks each one overlaps
+    def insert(self, gw, slots, dirty):
+        los, his, blocks = self.los[gw], self.his[gw], self.blocks[gw]
+        for p, s, e in zip(slots.tolist(), self.start[slots].tolist(), self.end(slots).tolist()):
+            a = bisect.bisect_right(his, s)
+            b = bisect.bisect_left(los, e)
+            parts = blocks[a:b]
+            lo = min([s] + los[a:b])
+            hi = max([e] + his[a:b])
+            block = [np.concatenate([[p]] + [q[0] for q in parts]),
+                     sum((q[1] for q in parts), np.zeros(3, dtype=np.int64)), lo]
+            for q in parts:
+                dirty.pop(id(q), None)
+            blocks[a:b] = [block]
+            los[a:b] = [lo]
+            his[a:b] = [hi]
+            dirty[id(block)] = (gw, block)
+
+    # sweep the blocks (gateway, block) again, in one go, and replace each
+    # one by its busy periods
+    def resweep(self, blocks):
+        seg = np.repeat(np.arange(len(blocks)), [len(block[0]) for gw, block in blocks])
+        idx = np.concatenate([block[0] for gw, block in blocks] + [np.zeros(0, dtype=np.int64)])
+        order = np.lexsort((self.node[idx], self.start[idx], seg))
+        idx, seg = idx[order], seg[order]
+        self.collided[idx], self.processed[idx] = self.decide(idx, seg, len(blocks))
+        self.swept += len(idx)
+        los, his, heads, parts = self.periods(idx, seg)
+        bounds = np.searchsorted(heads, np.arange(len(blocks) + 1)).tolist()
+        for k, (gw, block) in enumerate(blocks):
+            self.totals -= block[1]
+            i = bisect.bisect_left(self.los[gw], block[2])
+            a, b = bounds[k], bounds[k + 1]
+            self.los[gw][i:i + 1] = los[a:b]
+            self.his[gw][i:i + 1] = his[a:b]
+            self.blocks[gw][i:i + 1] = parts[a:b]
+
+    def configure(self, n, settings):
+        c = self.conf
+        for k, v in settings.items():
+            if k not in self.fields:
+                raise ValueError("cannot change '{}' of a node, only {}".format(k, ', '.join(self.fields)))
+            c[k][n] = v
+        sensi = np.array(self.meta['sensitivity'])
+        c['rectime'][n] = loraScenario.airtime(c['sf'][n], c['cr'][n], self.meta['payloadSize'], c['bw'][n])
+        c['sensitivity'][n] = sensi[c['sf'][n] - 7, [125, 250, 500].index(c['bw'][n]) + 1]
+        c['rssi'][n] = c['txpow'][n] - self.meta['radio']['GL'] - c['lpl'][n, c['gw'][n]]
+
+    # the counters as countPackets() gives them for the whole run
+    def result(self):
+        c = self.conf
+        current = np.array(TX)[np.asarray(c['txpow']).astype(int) + 2]
+        res = {
+            'sent': int(np.sum(self.sent)),
+            'collisions': int(self.totals[0]),
+            'received': int(self.totals[1]),
+            'processed': int(self.totals[2]),
+            'lost': int(np.sum(self.done[~self.reach()])),
+            'energy': float(np.sum(np.asarray(c['rectime'])*current*V*self.sent)/1e6),
+        }
+        if self.delay is not None:
+            res['deferred'] = self.deferred
+            res['delay'] = float(self.delayTotal)
+            res['dropped'] = int(np.sum(self.dropped))
+        return res
+
+    # the current configuration as a bundle
+    def bundle(self):
+        bundle = dict(self.conf)
+        bundle['meta'] = self.meta
+        return bundle
+
+def printResult(res):
+    print "energy (in J): ", res['energy']
+    print "sent packets: ", res['sent']
+    print "collisions: ", res['collisions']
+    print "received packets: ", res['received']
+    print "processed packets: ", res['processed']
+    print "lost packets: ", res['lost']
+    if 'deferred' in res:
+        print "deferred packets: ", res['deferred']
+        print "deferral (in ms): ", res['delay']
+        print "dropped packets: ", res['dropped']
+    if res['sent']:
+        print "DER:", (res['sent'] - res['collisions'])/float(res['sent'])
+        print "DER method 2:", res['received']/float(res['sent'])
+
+def printSummary(summary):
+    for key in ['energy', 'sent', 'collisions', 'received', 'processed', 'lost',
+                'deferred', 'delay', 'dropped', 'DER']:
+        if key in summary:
+            print "%-12s %16.4f +- %.4f" % (key, summary[key][0], summary[key][1])
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 6:
+        print "usage: ./loraSweep.py nrNodes avgSendTime payloadSizes experimentNrs simtime [full_collision] [--options]"
+        exit(-1)
+    nrNodes = int(args[1])
+    avgSendTime = int(args[2])
+    payloads = [int(v) for v in args[3].split(',')]
+    experiments = [int(v) for v in args[4].split(',')]
+    simtime = int(args[5])
+    full_collision = len(args) > 6 and bool(int(args[6]))
+    seed = int(opts['seed']) if 'seed' in opts else None
+    scenario = opts.get('scenario', defaultScenario)
+    jit = False if 'nojit' in opts else None
+
+    configs = [(pl, e) for pl in payloads for e in experiments]
+    bundles = [loraScenario.openBundle(scenario, nrNodes, pl, e, seed)[0] for pl, e in configs]
+    if 'delta' in opts:
+        with open(opts['delta']) as f:
+            delta = json.load(f)
+        start = time.time()
+        record = sweepRecord(bundles[0], avgSendTime, simtime, full_collision, seed, jit)
+        print "baseline: {} packets, {:.3f} s".format(record.size, time.time() - start)
+        printResult(record.result())
+        start = time.time()
+        res = record.change(delta)
+        print
+        print "changed {} nodes: {} packets swept again, {:.3f} s".format(
+            len(delta), record.swept, time.time() - start)
+        printResult(res)
+        if 'check' in opts:
+            full = simulate([record.bundle()], avgSendTime, simtime, full_collision, seed, jit)[0]
+            print "full run agrees:", full == res
+        exit(0)
+    log = loraLog.packetLog(opts['log']) if 'log' in opts else None
+    reps = int(opts.get('reps', 1))
+
+    # single runs are cached per configuration, as loraRun.py runs them;
+    # runs writing a log are not
+    params = {
+        'nrNodes': nrNodes,
+        'avgSendTime': avgSendTime,
+        'simtime': simtime,
+        'full_collision': full_collision,
+        'seed': seed,
+        'scenario': os.path.abspath(opts['scenario']) if 'scenario' in opts else None,
+        'options': (),
+    }
+    cache = loraCache.resultCache()
+    keys = [None]*len(configs)
+    if reps == 1 and log is None and 'nocache' not in opts:
+        keys = [loraCache.runKey('stream' if 'window' in opts else 'sweep',
+                                 dict(params, payloadSize=pl, experiment=e)) for pl, e in configs]
+    cached = [cache.get(k) if k is not None else None for k in keys]
+
+    if 'window' in opts:
+        for c, ((pl, e), b) in enumerate(zip(configs, bundles)):
+            start = time.time()
+            res = cached[c]
+            if res is None:
+                res = stream(b, avgSendTime, simtime, float(opts['window'] or defaultWindow),
+                             full_collision, seed, jit, log, c)
+                if keys[c] is not None:
+                    res['walltime'] = time.time() - start
+                    cache.put(keys[c], res, dict(params, payloadSize=pl, experiment=e, engine='stream'))
+            print "Payload (B):", pl, "Experiment:", e, "streamed: {:.3f} s".format(time.time() - start)
+            printResult(res)
+            print
+        if log is not None:
+            log.close()
+        exit(0)
+    start = time.time()
+    missing = [c for c in range(len(configs)) if cached[c] is None]
+    results = [[res] for res in cached]
+    if missing:
+        ran = replicate([bundles[c] for c in missing], avgSendTime, simtime, reps, full_collision,
+                        seed, jit, log)
+        for c, res in zip(missing, ran):
+            results[c] = res
+            if keys[c] is not None:
+                # the configurations share the run, and its time
+                res[0]['walltime'] = (time.time() - start)/len(missing)
+                pl, e = configs[c]
+                cache.put(keys[c], res[0], dict(params, payloadSize=pl, experiment=e, engine='sweep'))
+    if log is not None:
+        log.close()
+    if reps > 1:
+        print "{} replications: {:.3f} s".format(reps, time.time() - start)
+    for (pl, e), res in zip(configs, results):
+        print "Payload (B):", pl, "Experiment:", e
+        if reps > 1:
+            printSummary(replicationSummary(res))
+        else:
+            printResult(res[0])
+        print
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Hierarchical timer wheel for LoRaSim
+
+ Holds many pending timers (ACK timeouts, retransmission back-offs) at O(1)
+ cost to schedule and to cancel. Time is counted in ticks of 'tick' ms. The
+ wheel has 'levels' levels of 2**bits slots; a slot of level L spans
+ 2**(bits*L) ticks. A timer goes to the lowest level on which its tick
+ shares all higher digits with the current tick, in the slot of its digit
+ there. When the current tick reaches a slot of a higher level, its timers
+ are moved down (cascaded); a timer moves at most 'levels' times. Timers
+ beyond the top level wait in an overflow list.
+
+ Timers keep their exact time: the slot of the current tick is sorted when
+ it is expired, so timers fire in time order (ties in the order they were
+ scheduled). Cancelling only marks a timer; it is dropped when its slot is
+ visited.
+
+ next() skips empty slots a level at a time, so the cost of a run grows with
+ the timers and not with the simulated time.
+"""
+"""
+ SYNOPSIS:
+   ./loraTimers.py [timers]
+ DESCRIPTION:
+    schedules the given number of timers (default 1000000) at random times,
+    cancels half of them, expires the rest and prints the time per timer.
+"""
+
+import itertools
+import math
+import sys
+import time
+
+class timerWheel():
+    def __init__(self, tick=1.0, bits=6, levels=4):
+        self.tick = float(tick)
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.slots = [[[] for s in range(self.size)] for l in range(levels)]
+        self.overflow = []
+        self.now = 0
+        self.count = 0
+        self.order = itertools.count()
+
+    #
+    # schedule item at time t (ms); returns a handle for cancel(). A time
+    # before the current tick fires with the current tick.
+    #
+    def schedule(self, t, item):
+        timer = [t, next(self.order), item, True]
+        self.insert(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer[3]:
+            timer[3] = False
+            self.count -= 1
+
+    def insert(self, timer):
+        tick = max(int(math.floor(timer[0]/self.tick)), self.now)
+        for level in range(self.levels):
+            shift = self.bits*(level + 1)
+            if tick >> shift == self.now >> shift:
+                self.slots[level][(tick >> (shift - self.bits)) & self.mask].append(timer)
+                return
+        self.overflow.append(timer)
+
+    #
+    # time of the earliest pending timer, None if there is none. Moves the
+    # current tick up to its slot.
+    #
+    def next(self):
+        while self.count > 0:
+            for level in range(self.levels):
+                shift = self.bits*level
+                slots = self.slots[level]
+                # the slot of the current tick is empty on higher levels
+                first = ((self.now >> shift) & self.mask) + (level > 0)
+                for i in range(first, self.size):
+                    if slots[i]:
+                        slots[i] = [timer for timer in slots[i] if timer[3]]
+                    if slots[i]:
+                        break
+                else:
+                    continue
+                # start of slot i of this level; the lower levels are empty
+                top = shift + self.bits
+                self.now = ((self.now >> top) << top) + (i << shift)
+                if level == 0:
+                    return min(timer[0] for timer in slots[i])
+                timers, slots[i] = slots[i], []
+                for timer in timers:
+                    self.insert(timer)
+                break
+            else:
+                # all levels are empty, go to the earliest overflow timer
+                timers = [timer for timer in self.overflow if timer[3]]
+                self.overflow = []
+                self.now = max(self.now, min(int(math.floor(timer[0]/self.tick)) for timer in timers))
+                for timer in timers:
+                    self.insert(timer)
+        return None
+
+    #
+    # items of the timers due at time t (at or before it), in time order.
+    # Call after next(), with t at least the time it returned.
+    #
+    def expire(self, t):
+        slot = self.slots[0][self.now & self.mask]
+        due = sorted(timer for timer in slot if timer[3] and timer[0] <= t)
+        self.slots[0][self.now & self.mask] = [timer for timer in slot if timer[3] and timer[0] > t]
+        self.count -= len(due)
+        for timer in due:
+            timer[3] = False
+        return [timer[2] for timer in due]
+
+if __name__ == '__main__':
+    import random
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    wheel = timerWheel()
+    times = [random.uniform(0, 3600000) for i in range(n)]
+    start = time.time()
+    timers = [wheel.schedule(t, i) for i, t in enumerate(times)]
+    scheduled = time.time()
+    for timer in timers[::2]:
+        wheel.cancel(timer)
+    cancelled = time.time()
+    fired = []
+    while True:
+        t = wheel.next()
+        if t is None:
+            break
+        fired += wheel.expire(t)
+    done = time.time()
+    assert fired == sorted(range(1, n, 2), key=lambda i: (times[i], i))
+    print "timers: {}, schedule {:.2f} us, cancel {:.2f} us, expire {:.2f} us per timer".format(
+        n, 1e6*(scheduled - start)/n, 1e6*(cancelled - scheduled)/(n//2),
+        1e6*(done - cancelled)/(n - n//2))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Traffic models for LoRaSim
+
+ The 'traffic' section of a scenario file selects how nodes generate
+ packets. The default, poisson, is the renewal process of loraSim.py: a node
+ waits an exponential time with mean avgSendTime after the end of its
+ previous packet. It depends on the airtime and stays with the engines.
+
+ The other models generate the packet times of all nodes at once as arrays,
+ independent of the radio settings:
+
+    {"model": "periodic", "period": ms, "jitter": ms}
+        every node sends once per period (default avgSendTime) at a random
+        phase, each packet shifted uniformly by up to +-jitter.
+    {"model": "onoff", "on": ms, "off": ms}
+        nodes alternate between on and off phases of exponential length
+        (means 'on' and 'off') and send as a Poisson process during the on
+        phases only; the rate is raised so that the mean interval over the
+        whole run stays avgSendTime.
+    {"model": "storm", "interval": ms, "radius": m, "delay": ms,
+     "p": 1.0, "background": true}
+        alarm events happen as a Poisson process with mean 'interval' at
+        uniform positions over the area of the nodes. Every node within
+        'radius' of an event reports it with probability p after an
+        exponential delay with mean 'delay'. With background, the nodes also
+        send Poisson traffic with mean interval avgSendTime.
+
+ A node sends one packet at a time: a packet generated while the previous
+ one is on air is sent right after it (serialize()). Under a duty cycle limit
+ (see loraScenario.dutyCycles()) a node that sent a packet of airtime T
+ waits until T/duty after its start; it holds at most 'queue' packets
+ meanwhile and drops the ones generated while its queue is full
+ (dutyCycle()).
+"""
+"""
+ SYNOPSIS:
+   ./loraTraffic.py <scenario> <nodes> <avgsend> <simtime> [seed]
+ DESCRIPTION:
+    generates the packet times of the scenario's traffic model and prints
+    their count and the largest number generated in one second.
+"""
+
+import sys
+from collections import deque
+
+import numpy as np
+
+#
+# seed of the traffic draws. Scenario bundles are drawn with the seed itself,
+# reusing that stream would tie the first draws of the nodes to their
+# positions (e.g. the phase of a periodic node to its angle). Replication
+# rep of a batch of several (loraSweep.replicate()) draws from the stream
+# trafficSeed(seed, rep), whatever its traffic model, and so do the epochs
+# of a streamed run (loraSweep.wakeStream) from one each.
+#
+def trafficSeed(seed, rep=None, epoch=None):
+    if seed is None:
+        return None
+    if epoch is not None:
+        return [seed, 1, rep or 0, epoch]
+    return [seed, 1] if rep is None else [seed, 1, rep]
+
+def periodicArrivals(traffic, x, y, avgSendTime, simtime, rng):
+    n = len(x)
+    period = float(traffic.get('period', avgSendTime))
+    jitter = float(traffic.get('jitter', 0))
+    k = int(simtime/period) + 2
+    phase = rng.uniform(0, period, n)
+    t = phase[:, None] + period*np.arange(k) + rng.uniform(-jitter, jitter, (n, k))
+    return np.repeat(np.arange(n), k), np.maximum(t.ravel(), 0)
+
+def onoffArrivals(traffic, x, y, avgSendTime, simtime, rng):
+    n = len(x)
+    on = float(traffic['on'])
+    off = float(traffic['off'])
+    rate = (on + off)/(on*avgSendTime)
+    # cycles of an off and an on phase; a node starts in the on phase with
+    # probability on/(on+off), the rest of a phase is again exponential
+    k = int(simtime/(on + off)) + 4
+    while True:
+        offLen = rng.exponential(off, (n, k))
+        offLen[:, 0] *= rng.random_sample(n) < off/(on + off)
+        onLen = rng.exponential(on, (n, k))
+        onStart = np.cumsum(offLen + onLen, axis=1) - onLen
+        if np.all(onStart[:, -1] + onLen[:, -1] >= simtime):
+            break
+        k = 2*k
+    counts = rng.poisson(onLen*rate).ravel()
+    node = np.repeat(np.repeat(np.arange(n), k), counts)
+    t = np.repeat(onStart.ravel(), counts) + \
+        rng.random_sample(counts.sum())*np.repeat(onLen.ravel(), counts)
+    return node, t
+
+def stormArrivals(traffic, x, y, avgSendTime, simtime, rng):
+    n = len(x)
+    radius = float(traffic['radius'])
+    delay = float(traffic.get('delay', 1000))
+    p = float(traffic.get('p', 1.0))
+    nodes = [np.zeros(0, dtype=int)]
+    times = [np.zeros(0)]
+    if traffic.get('background', True):
+        counts = rng.poisson(float(simtime)/avgSendTime, n)
+        nodes.append(np.repeat(np.arange(n), counts))
+        times.append(rng.uniform(0, simtime, counts.sum()))
+    events = rng.poisson(float(simtime)/traffic['interval'])
+    ex = rng.uniform(np.min(x), np.max(x), events)
+    ey = rng.uniform(np.min(y), np.max(y), events)
+    et = rng.uniform(0, simtime, events)
+    for i in range(events):
+        hit = np.nonzero((np.hypot(x - ex[i], y - ey[i]) <= radius) &
+                         (rng.random_sample(n) < p))[0]
+        nodes.append(hit)
+        times.append(et[i] + rng.exponential(delay, len(hit)))
+    return np.concatenate(nodes), np.concatenate(times)
+
+models = {
+    'periodic': periodicArrivals,
+    'onoff': onoffArrivals,
+    'storm': stormArrivals,
+}
+
+#
+# packet generation times of all nodes for the traffic section of a
+# scenario, sorted by node and time. Node positions are needed by the
+# storm model.
+#
+def arrivals(traffic, x, y, avgSendTime, simtime, rng):
+    if traffic['model'] not in models:
+        raise ValueError("traffic model '{}' has no arrival arrays".format(traffic['model']))
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    node, t = models[traffic['model']](traffic, x, y, float(avgSendTime), simtime, rng)
+    keep = t < simtime
+    node, t = node[keep], t[keep]
+    order = np.lexsort((t, node))
+    return node[order], t[order]
+
+#
+# send times: a node sends at the generation time of a packet or, if it is
+# still sending the previous one, right after it. With k the index of a
+# packet of its node, s[k] = max(t[k], s[k-1] + r) gives
+# s[k] - k*r = max over j <= k of (t[j] - j*r), a running maximum per node.
+# node and t as returned by arrivals(), rectime per node.
+#
+def serialize(node, t, rectime):
+    if len(t) == 0:
+        return t
+    first = np.r_[0, np.nonzero(np.diff(node))[0] + 1]
+    k = np.arange(len(t)) - np.repeat(first, np.diff(np.r_[first, len(t)]))
+    r = np.asarray(rectime, dtype=float)[node]
+    v = t - k*r
+    # running maximum restarting at every node: lift each node above the
+    # previous ones
+    lift = np.cumsum(np.r_[0, np.diff(node) != 0])*(v.max() - v.min() + 1)
+    s = np.maximum.accumulate(v + lift) - lift + k*r
+    # the lift costs precision, make sure a packet starts no earlier than
+    # the end of the previous one of its node (the engines compare them)
+    same = node[1:] == node[:-1]
+    while True:
+        ends = s[:-1] + r[:-1]
+        early = same & (s[1:] < ends)
+        if not early.any():
+            return s
+        s[1:][early] = ends[early]
+
+#
+# send times under a duty cycle limit: a packet starts spacing (airtime/duty,
+# per node) after the previous one of its node at the earliest. A node holds
+# up to queue packets that wait to be sent, a packet generated when it holds
+# that many is dropped (queue None: no limit). node and t as returned by
+# arrivals(). Returns which packets are kept, the send times (of the kept
+# ones) and the time the duty cycle added to the wait of each packet.
+#
+def dutyCycle(node, t, rectime, spacing, queue=None):
+    rectime = np.asarray(rectime, dtype=float)
+    spacing = np.asarray(spacing, dtype=float)
+    keep = np.ones(len(t), dtype=bool)
+    s = serialize(node, t, spacing)
+    if queue is not None:
+        # packets are only held, and dropped, at nodes where some waited
+        first = np.searchsorted(node, np.arange(len(rectime)))
+        last = np.searchsorted(node, np.arange(len(rectime)), side='right')
+        for n in np.unique(node[s > t]):
+            held = deque()
+            prev = None
+            for k in range(first[n], last[n]):
+                while held and held[0] <= t[k]:
+                    held.popleft()
+                if len(held) >= queue:
+                    keep[k] = False
+                    continue
+                s[k] = t[k] if prev is None else max(t[k], prev + spacing[n])
+                held.append(s[k])
+                prev = s[k]
+    # the wait beyond the generation time and the end of the previous
+    # packet; less than a nanosecond is rounding of serialize()
+    kept = np.nonzero(keep)[0]
+    prevEnd = np.r_[-np.inf, (s + rectime[node])[kept][:-1]]
+    prevEnd[np.r_[True, node[kept][1:] != node[kept][:-1]]] = -np.inf
+    delay = np.zeros(len(t))
+    delay[kept] = s[kept] - np.maximum(t[kept], prevEnd)
+    delay[delay < 1e-6] = 0.0
+    return keep, s, delay
+
+if __name__ == '__main__':
+    import loraScenario
+    if len(sys.argv) < 5:
+        print "usage: ./loraTraffic.py scenario nrNodes avgSendTime simtime [seed]"
+        exit(-1)
+    seed = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    bundle = loraScenario.openBundle(sys.argv[1], int(sys.argv[2]), 20, 0, seed)[0]
+    traffic = bundle['meta']['traffic']
+    node, t = arrivals(traffic, bundle['x'], bundle['y'], int(sys.argv[3]), int(sys.argv[4]),
+                       np.random.RandomState(trafficSeed(seed)))
+    print "model:", traffic['model'], "packets:", len(t)
+    if len(t):
+        print "most packets in one second:", np.bincount((t/1000).astype(int)).max()
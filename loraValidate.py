@@ -0,0 +1,198 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+ Statistical equivalence of LoRaSim engines
+
+ Runs a reference and a candidate engine on the same seeded scenarios over a
+ grid of loads (avgSendTime) and experiments and compares, per grid point,
+ the distributions of collisions, received, lost and processed packets with
+ Welch's t-test (means) and the two-sample Kolmogorov-Smirnov test (shape).
+ The candidate is accepted when no test rejects at the Bonferroni corrected
+ level. The speed-up of the candidate is reported alongside.
+"""
+"""
+ SYNOPSIS:
+   ./loraValidate.py <reference> <candidate> [--options]
+ DESCRIPTION:
+    reference, candidate
+        an engine of loraRun.py, optionally followed by simulator options,
+        e.g. "simpy" or "simpy --sinr".
+    options
+        --nodes=130           number of nodes
+        --loads=10000,60000   avgSendTime values (ms)
+        --experiments=0,1,3   experiments
+        --payload=20          payload size (B)
+        --simtime=600000      simulated time (ms)
+        --collision=0         full collision check
+        --reps=20             replications per engine and grid point
+        --seed=1              seed of the first replication
+        --scenario=file       scenario file
+        --alpha=0.01          family-wise significance level
+ OUTPUT
+    one line per grid point and metric, then the speed-up and the verdict.
+    The exit status is 0 when the engines agree and 1 otherwise.
+"""
+
+import math
+import sys
+
+import numpy as np
+
+import loraRun
+
+metrics = ['collisions', 'received', 'lost', 'processed']
+
+#
+# continued fraction of the incomplete beta function (Numerical Recipes)
+#
+def betacf(a, b, x):
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab*x/qap
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0/d
+    h = d
+    for m in range(1, 300):
+        m2 = 2*m
+        aa = m*(b - m)*x/((qam + m2)*(a + m2))
+        d = 1.0 + aa*d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa/c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0/d
+        h *= d*c
+        aa = -(a + m)*(qab + m)*x/((a + m2)*(qap + m2))
+        d = 1.0 + aa*d
+        if abs(d) < tiny:
+            d = tiny
+        c = 1.0 + aa/c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0/d
+        de = d*c
+        h *= de
+        if abs(de - 1.0) < 1e-12:
+            break
+    return h
+
+# regularized incomplete beta function I_x(a, b)
+def betai(a, b, x):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a*math.log(x) + b*math.log(1.0 - x))
+    if x < (a + 1.0)/(a + b + 2.0):
+        return front*betacf(a, b, x)/a
+    return 1.0 - front*betacf(b, a, 1.0 - x)/b
+
+#
+# Welch's t-test, two sided p-value
+#
+def welch(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    vx = x.var(ddof=1)/len(x)
+    vy = y.var(ddof=1)/len(y)
+    diff = x.mean() - y.mean()
+    if vx + vy == 0:
+        # both samples constant
+        return 1.0 if diff == 0 else 0.0
+    t = diff/math.sqrt(vx + vy)
+    df = (vx + vy)**2/(vx**2/(len(x) - 1) + vy**2/(len(y) - 1))
+    return betai(0.5*df, 0.5, df/(df + t*t))
+
+#
+# two-sample Kolmogorov-Smirnov test, asymptotic p-value
+#
+def ks2(x, y):
+    x = np.sort(np.asarray(x, dtype=float))
+    y = np.sort(np.asarray(y, dtype=float))
+    allv = np.concatenate([x, y])
+    cdfx = np.searchsorted(x, allv, side='right')/float(len(x))
+    cdfy = np.searchsorted(y, allv, side='right')/float(len(y))
+    D = np.max(np.abs(cdfx - cdfy))
+    if D == 0:
+        return 1.0
+    en = math.sqrt(len(x)*len(y)/float(len(x) + len(y)))
+    lam = (en + 0.12 + 0.11/en)*D
+    p = 0.0
+    for j in range(1, 101):
+        term = 2*(-1)**(j - 1)*math.exp(-2*lam*lam*j*j)
+        p += term
+        if abs(term) < 1e-10:
+            break
+    return min(max(p, 0.0), 1.0)
+
+def parseEngine(spec):
+    words = spec.split()
+    return words[0], words[1:]
+
+#
+# run both engines over the grid, returns the report lines, the speed-up
+# and whether the engines agree
+#
+def validate(reference, candidate, nodes=130, loads=(10000, 60000), experiments=(0, 1, 3),
+             payload=20, simtime=600000, collision=False, reps=20, seed=1, scenario=None,
+             alpha=0.01):
+    refEngine, refOptions = parseEngine(reference)
+    candEngine, candOptions = parseEngine(candidate)
+    ntests = 2*len(metrics)*len(loads)*len(experiments)
+    level = alpha/ntests
+    lines = []
+    agree = True
+    walltime = {'ref': 0.0, 'cand': 0.0}
+    for experiment in experiments:
+        for load in loads:
+            samples = {'ref': [], 'cand': []}
+            for r in range(reps):
+                for name, engine, options in [('ref', refEngine, refOptions),
+                                              ('cand', candEngine, candOptions)]:
+                    res = loraRun.runSimulation(nodes, load, payload, experiment, simtime,
+                                                collision, seed + r, scenario, engine, options)
+                    samples[name].append(res)
+                    walltime[name] += res['walltime']
+            for m in metrics:
+                x = [res[m] for res in samples['ref']]
+                y = [res[m] for res in samples['cand']]
+                pt = welch(x, y)
+                pks = ks2(x, y)
+                ok = pt >= level and pks >= level
+                agree = agree and ok
+                lines.append("exp {} load {:>7} {:<10} ref {:10.1f} cand {:10.1f}  p(t) {:.4f}  p(ks) {:.4f}  {}".format(
+                    experiment, load, m, np.mean(x), np.mean(y), pt, pks, 'ok' if ok else 'DIFFERENT'))
+    speedup = walltime['ref']/walltime['cand'] if walltime['cand'] > 0 else float('inf')
+    return lines, speedup, agree
+
+if __name__ == '__main__':
+    opts = dict((a[2:].split('=', 1) + [''])[:2] for a in sys.argv[1:] if a.startswith('--'))
+    args = [a for a in sys.argv if not a.startswith('--')]
+    if len(args) < 3:
+        print "usage: ./loraValidate.py reference candidate [--nodes=N] [--loads=a,b] [--experiments=a,b]"
+        print "       [--payload=B] [--simtime=ms] [--collision=0|1] [--reps=R] [--seed=S] [--scenario=file] [--alpha=a]"
+        exit(-1)
+    ints = lambda s: [int(v) for v in s.split(',')]
+    lines, speedup, agree = validate(
+        args[1], args[2],
+        nodes=int(opts.get('nodes', 130)),
+        loads=ints(opts.get('loads', '10000,60000')),
+        experiments=ints(opts.get('experiments', '0,1,3')),
+        payload=int(opts.get('payload', 20)),
+        simtime=int(opts.get('simtime', 600000)),
+        collision=bool(int(opts.get('collision', 0))),
+        reps=int(opts.get('reps', 20)),
+        seed=int(opts.get('seed', 1)),
+        scenario=opts.get('scenario'),
+        alpha=float(opts.get('alpha', 0.01)))
+    for line in lines:
+        print line
+    print "speed-up: {:.2f}".format(speedup)
+    print "VERDICT:", "agree" if agree else "disagree"
+    exit(0 if agree else 1)